@@ -1,6 +1,14 @@
 """
 This class maps abundances from a MESA profile to a reduced set for FLASH.
 
+The mapping is done by a CompositionReducer, which reduces a (zones, isotopes)
+block of MESA mass fractions to a set of target species through a sparse
+mapping matrix and a list of constraint rules, e.g. for the FLASH set:
+
+    reducer = CompositionReducer(['c12', 'o16', 'ne20'], ['c12', 'o16', 'ne20', 'ne22'],
+                                 rules=[('ye', 'ne22'), ('ratio', ['ne20', 'o16'])])
+    xflash = reducer.reduce(xmesa, ye=mstar['ye'])
+
 Copyright 2015 Donald E. Willcox
 
 This file is part of mesa2flash.
@@ -20,26 +28,112 @@ This file is part of mesa2flash.
 """
 import numpy as np
 from collections import OrderedDict
+from elements import PeriodicTable
+
+def renormalize(x, out=None):
+	## Divide each row of the (zones, species) abundance block x by its sum,
+	## into out if given (which may be x itself, to renormalize in place).
+	## The row sums are accumulated species by species, in the same order
+	## as a loop over the species of each zone would.
+	if x.shape[1] == 0:
+		return x if out is None else out
+	sumx = x[:,0].copy()
+	for n in range(1, x.shape[1]):
+		sumx += x[:,n]
+	return np.divide(x, sumx[:,None], out=out)
+
+class CompositionReducer:
+	def __init__(self, isotopes, species, mapping=None, rules=None):
+		## isotopes: names of the MESA isotopes, the columns of the abundance blocks to reduce
+		## species: names of the target species, the columns of the reduced blocks
+		## mapping: dictionary from target species to the isotopes summed into it,
+		##          either a list of names or a dictionary of names and weights.
+		##          Species not in mapping take the isotope of the same name, if any.
+		## rules: list of constraints applied in order after the mapping:
+		##        ('ye', s): set species s, a neutron-rich isotope, from the electron
+		##                   fraction Ye: X = (0.5 - Ye)/(0.5 - Z/A), and at least 0,
+		##                   assuming the rest of the composition has Z/A = 1/2
+		##        ('ratio', [s, ..., r]): give species s, ..., r the mass left over by
+		##                   the other species, keeping their ratios to species r
+		self.isotopes = list(isotopes)
+		self.species = list(species)
+		if mapping is None:
+			mapping = {}
+		self.rules = list(rules) if rules else []
+
+		## The mapping matrix of shape (species, isotopes) in compressed
+		## sparse row form: the isotopes indices[indptr[m]:indptr[m+1]] with
+		## weights weights[indptr[m]:indptr[m+1]] make up species m
+		indices = []
+		weights = []
+		self.indptr = np.zeros(len(self.species)+1, dtype=np.int64)
+		for m, s in enumerate(self.species):
+			src = mapping.get(s, [s] if s in self.isotopes else [])
+			if not isinstance(src, dict):
+				src = OrderedDict([(k, 1.0) for k in src])
+			for k, w in src.items():
+				indices.append(self.isotopes.index(k))
+				weights.append(w)
+			self.indptr[m+1] = len(indices)
+		self.indices = np.array(indices, dtype=np.int64)
+		self.weights = np.array(weights, dtype=np.float64)
+
+		## Factors (A/(A/2 - Z)) = 1/(0.5 - Z/A) of the species set from Ye
+		self.ye_factor = {}
+		for kind, s in self.rules:
+			if kind == 'ye':
+				iso = PeriodicTable.lookup_isotope(s)
+				self.ye_factor[s] = float(iso.A)/(0.5*iso.A - iso.Z)
+			elif kind != 'ratio':
+				raise ValueError('unknown composition rule ' + str(kind))
+
+	def reduce(self, x, ye=None, out=None):
+		## Reduce the (zones, isotopes) abundance block x to a (zones, species)
+		## block, written to out if given.
+		## ye: electron fraction of each zone, needed by 'ye' rules
+		if out is None:
+			out = np.empty((x.shape[0], len(self.species)), dtype=np.float64)
+		## Apply the mapping matrix: sum the weighted isotopes of each species
+		mapped = np.diff(self.indptr) > 0
+		if len(self.indices):
+			products = x[:,self.indices]*self.weights
+			out[:,mapped] = np.add.reduceat(products, self.indptr[:-1][mapped], axis=1)
+		out[:,~mapped] = 0.0
+
+		for kind, s in self.rules:
+			if kind == 'ye':
+				m = self.species.index(s)
+				out[:,m] = np.maximum(self.ye_factor[s]*(0.5-ye), 0.0)
+			else:
+				group = [self.species.index(k) for k in s]
+				## Mass left over for the group by the other species
+				xother = 1.0
+				for m in range(len(self.species)):
+					if m not in group:
+						xother = xother - out[:,m]
+				## Ratios to the last species of the group
+				ratios = [out[:,m]/out[:,group[-1]] for m in group[:-1]] + [1.0]
+				rsum = ratios[0]
+				for r in ratios[1:]:
+					rsum = rsum + r
+				for m, r in zip(group, ratios):
+					out[:,m] = r*xother/rsum
+		return out
 
 # Map abundances to set of C12, O16, Ne20, Ne22 for flash!
 class MapMesaComposition:
 	def __init__(self):
-		self.fmap = OrderedDict([('c12',np.array([])),
-					('o16',np.array([])),
-					('ne20',np.array([])),
-					('ne22',np.array([]))])
+		## Maintain constant C12 abundance, determine Ne22 abundance from
+		## model Ye, and split the rest between Ne20 and O16 keeping their ratio
+		self.reducer = CompositionReducer(['c12', 'o16', 'ne20'], ['c12', 'o16', 'ne20', 'ne22'],
+						  rules=[('ye', 'ne22'), ('ratio', ['ne20', 'o16'])])
+		self.fmap = OrderedDict([(k, np.array([])) for k in self.reducer.species])
+
 	def getmap(self,ms):
-		## Maintain constant C12 abundance
-		self.fmap['c12'] = ms['c12']
-		## Determine Ne22 abundance from model Ye
-		self.fmap['ne22'] = np.maximum(22.0*(0.5-ms['ye']), 0.0)
-		## Normalization requires Ne20 + O16 abundances = xother
-		xother = 1.0 - self.fmap['c12'] - self.fmap['ne22']
-		## Ne20/O16 ratio remains constant
-		rneo = ms['ne20']/ms['o16']
-		## Use rneo and xother constraints to find Ne20 and O16 abundances
-		self.fmap['o16'] = xother/(rneo+1.0)
-		self.fmap['ne20'] = rneo*xother/(rneo+1.0)
-		for k in self.fmap.keys():
-			ms[k] = self.fmap[k]
-		return ms	
+		## Return a dictionary of the reduced abundances of the star ms.
+		## ms itself is not modified.
+		x = np.column_stack([ms[k] for k in self.reducer.isotopes])
+		xr = self.reducer.reduce(x, ye=ms['ye'])
+		for n, k in enumerate(self.reducer.species):
+			self.fmap[k] = xr[:,n]
+		return self.fmap
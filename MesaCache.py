@@ -0,0 +1,184 @@
+"""
+This class provides a binary cache of parsed MESA profile and history files.
+
+The first time a file is parsed, its data block is written as a .npy
+array next to a small .json file holding the header, the field names and
+the size and modification time of the source file. Later reads load the
+array memory-mapped instead of parsing the text, as long as the source
+file has not changed since.
+
+The cache can be configured through the environment:
+MESAUTILS_CACHE_DIR: directory to keep the cache files in. If set, MesaProfile
+                     uses the cache by default.
+MESAUTILS_CACHE_MAX_BYTES: total size of the cache directory above which
+                           the least recently used entries are removed.
+MESAUTILS_NO_CACHE: if set to anything but '' or '0', never use the cache.
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import json
+import tempfile
+import hashlib
+import numpy as np
+from collections import OrderedDict
+
+## The process umask, read once at import: reading it means setting it,
+## which is not safe while other threads create files
+umask = os.umask(0)
+os.umask(umask)
+
+class MesaCache(object):
+    def __init__(self, location=None, max_bytes=None, enabled=True):
+        ## location: directory for the cache files. If None, use
+        ##           MESAUTILS_CACHE_DIR, or else write the cache files
+        ##           next to each source file.
+        ## max_bytes: evict least recently used entries from location
+        ##            once it holds more than this many bytes.
+        ##            Eviction only applies to a cache directory.
+        ## enabled: if False, load and save do nothing.
+        if location is None:
+            location = os.environ.get('MESAUTILS_CACHE_DIR') or None
+        if max_bytes is None and os.environ.get('MESAUTILS_CACHE_MAX_BYTES'):
+            max_bytes = int(float(os.environ['MESAUTILS_CACHE_MAX_BYTES']))
+        if os.environ.get('MESAUTILS_NO_CACHE', '0') not in ['', '0']:
+            enabled = False
+        self.location = location
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+
+    @classmethod
+    def fromEnvironment(self):
+        ## Return the cache configured by the environment, or None
+        ## if MESAUTILS_CACHE_DIR is not set or caching is disabled.
+        cache = self()
+        if cache.location is None or not cache.enabled:
+            return None
+        return cache
+
+    def getPaths(self, source):
+        ## Return the paths of the array and metadata files for source
+        source = os.path.abspath(source)
+        if self.location is None:
+            base = source + '.cache'
+        else:
+            key = hashlib.sha1(source.encode('utf-8')).hexdigest()
+            base = os.path.join(self.location, os.path.basename(source) + '.' + key)
+        return base + '.npy', base + '.json'
+
+    def load(self, source):
+        ## Return (metadata, data) for source, with data memory-mapped,
+        ## or None if there is no valid cache entry.
+        if not self.enabled:
+            return None
+        npy, meta = self.getPaths(source)
+        try:
+            with open(meta, 'r') as f:
+                m = json.load(f, object_pairs_hook=OrderedDict)
+            st = os.stat(source)
+            if m['size'] != st.st_size or m['mtime'] != st.st_mtime:
+                return None
+            data = np.load(npy, mmap_mode='c')
+        except (IOError, OSError, ValueError, KeyError):
+            return None
+        if data.shape[0] != len(m['fields']):
+            return None
+        # Mark the entry as recently used for eviction
+        try:
+            os.utime(meta, None)
+        except OSError:
+            pass
+        return m, data
+
+    def save(self, source, stat, metadata, data):
+        ## Write data and metadata as the cache entry for source.
+        ## stat is os.stat(source) taken before source was parsed,
+        ## so a file modified during the parse is never considered valid.
+        if not self.enabled:
+            return
+        npy, meta = self.getPaths(source)
+        m = OrderedDict(metadata)
+        m['source'] = os.path.abspath(source)
+        m['size'] = stat.st_size
+        m['mtime'] = stat.st_mtime
+        temps = []
+        try:
+            if self.location is not None and not os.path.isdir(self.location):
+                os.makedirs(self.location)
+            # Write to temporary files unique to this writer and rename them
+            # into place, so readers never see partial entries even when several
+            # processes save the same entry at once. The data is renamed first,
+            # so a metadata file always describes complete data.
+            temps.append(self.writeTemp(npy, lambda f: np.save(f, np.ascontiguousarray(data))))
+            temps.append(self.writeTemp(meta, lambda f: f.write(json.dumps(m).encode())))
+            os.replace(temps[0], npy)
+            os.replace(temps[1], meta)
+        except (IOError, OSError):
+            # The cache is only an optimization, e.g. LOGS may be read-only
+            for t in temps:
+                try:
+                    os.remove(t)
+                except OSError:
+                    pass
+            return
+        self.evict()
+
+    def writeTemp(self, path, write):
+        ## Call write on a new binary temporary file in the directory of path
+        ## and return its name. The file is removed if writing fails.
+        fd, tmp = tempfile.mkstemp(prefix=os.path.basename(path) + '.', suffix='.tmp',
+                                   dir=os.path.dirname(os.path.abspath(path)))
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                # mkstemp creates the file readable by its owner only; give it the
+                # permissions of a file made with open, e.g. for a shared cache directory
+                os.chmod(tmp, 0o666 & ~umask)
+                write(f)
+        except BaseException:
+            os.remove(tmp)
+            raise
+        return tmp
+
+    def evict(self):
+        ## Remove least recently used entries until the cache directory
+        ## holds at most max_bytes.
+        if self.location is None or self.max_bytes is None:
+            return
+        entries = []
+        total = 0
+        for f in os.listdir(self.location):
+            if not f.endswith('.json'):
+                continue
+            meta = os.path.join(self.location, f)
+            npy = meta[:-len('.json')] + '.npy'
+            try:
+                size = os.path.getsize(meta) + os.path.getsize(npy)
+                used = os.path.getmtime(meta)
+            except OSError:
+                continue
+            entries.append((used, size, meta, npy))
+            total += size
+        for used, size, meta, npy in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            for p in [meta, npy]:
+                try:
+                    os.remove(p)
+                except OSError:
+                    pass
+            total -= size
@@ -0,0 +1,108 @@
+"""
+This class builds and queries a catalog of the profiles in MESA LOGS directories.
+
+Only the header of each profile is read, so building the catalog does not
+touch the profile bodies, and the catalog can be saved and loaded as a
+compact table to answer later queries without reading any profile at all.
+
+Usage:
+    catalog = MesaCatalog()
+    catalog.build(['run1/LOGS', 'run2/LOGS'])
+    catalog.save('catalog.npz')
+    ...
+    catalog = MesaCatalog('catalog.npz')
+    pname = catalog.closest('star_age', 1.0e9)
+    pnames = catalog.select(catalog.table['star_mass'] < 1.2)
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import glob
+import numpy as np
+from multiprocessing import Pool
+from collections import OrderedDict
+from MesaProfile import MesaProfile
+
+def readProfileHeader(pname):
+    ## Return the header of profile pname as a dictionary
+    return MesaProfile(pname, header_only=True).head
+
+class MesaCatalog(object):
+    def __init__(self, cname=None):
+        ## The catalog is a dictionary of numpy arrays with one entry per
+        ## profile: 'path' holds the profile file names and the other
+        ## entries the numeric header fields shared by all the profiles.
+        self.table = OrderedDict([])
+        if cname:
+            self.load(cname)
+
+    def build(self, logs_dirs, pattern='profile*.data', fields=None, processes=None):
+        ## Read the headers of all profiles matching pattern in each of
+        ## logs_dirs, using a pool of processes (default: one per core).
+        ## fields: list of header fields to keep, default all numeric ones.
+        if isinstance(logs_dirs, str):
+            logs_dirs = [logs_dirs]
+        pnames = []
+        for d in logs_dirs:
+            pnames += sorted(glob.glob(os.path.join(d, pattern)))
+        if processes == 1 or len(pnames) < 2:
+            heads = [readProfileHeader(p) for p in pnames]
+        else:
+            pool = Pool(processes)
+            try:
+                heads = pool.map(readProfileHeader, pnames, chunksize=max(1, len(pnames)//64))
+            finally:
+                pool.close()
+                pool.join()
+
+        if fields is None:
+            fields = []
+            if heads:
+                fields = [k for k, v in heads[0].items()
+                          if not isinstance(v, str) and all([k in h for h in heads])]
+        self.table = OrderedDict([])
+        self.table['path'] = np.array(pnames, dtype=str)
+        for k in fields:
+            self.table[k] = np.array([h[k] for h in heads])
+        return self.table
+
+    def save(self, cname):
+        ## Write the catalog to the numpy archive cname
+        np.savez(cname, **self.table)
+
+    def load(self, cname):
+        ## Read a catalog written by save
+        archive = np.load(cname)
+        self.table = OrderedDict([])
+        self.table['path'] = archive['path']
+        for k in archive.files:
+            if k != 'path':
+                self.table[k] = archive[k]
+        archive.close()
+        return self.table
+
+    def closest(self, field, value):
+        ## Return the profile whose header field is closest to value
+        if len(self.table['path']) == 0:
+            return None
+        return self.table['path'][np.argmin(np.abs(self.table[field] - value))]
+
+    def select(self, mask):
+        ## Return the profiles for which the boolean array mask is True,
+        ## e.g. select(catalog.table['star_mass'] < 1.2)
+        return list(self.table['path'][mask])
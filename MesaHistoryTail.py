@@ -0,0 +1,136 @@
+"""
+This class incrementally reads a MESA history file that is still being written.
+
+Each call to refresh() parses only the lines appended since the previous
+call, so monitoring a running job costs time proportional to the new data
+rather than to the size of the file. When MESA backs up or restarts and
+model_number goes backwards, the rows at or after the repeated model
+number are dropped so star always holds one consistent sequence.
+
+Usage:
+    tail = MesaHistoryTail('LOGS/history.data', columns=['star_age', 'log_L'])
+    while running:
+        nnew = tail.refresh()
+        plot(tail.star['star_age'], tail.star['log_L'])
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import numpy as np
+from collections import OrderedDict
+from MesaProfile import MesaProfile, MesaStar
+
+class MesaHistoryTail(object):
+    def __init__(self, hname, columns=None, capacity=1024):
+        self.inHistoryName = hname
+        ## If columns is a list of field names, only those fields are kept
+        self.columns = columns
+        self.capacity = capacity
+        self.reset()
+
+    def reset(self):
+        ## Forget everything read so far
+        self.head = OrderedDict([])
+        self.head_fields = []
+        self.zone_fields = []
+        self.data_fields = []
+        ## Byte offset in the file of the first line not yet parsed,
+        ## None until the header has been read
+        self.offset = None
+        self.usecols = []
+        ## data has shape (fields, capacity) and the first nrows columns are valid.
+        ## The last row of data is always model_number.
+        self.data = np.empty((0, 0), dtype=np.float64)
+        self.nrows = 0
+        ## star is a MesaStar, so derived fields are available as from MesaProfile
+        self.star = MesaStar()
+
+    def readHeader(self, fin):
+        ## Read the header, return False if it is not completely written yet
+        lines = [fin.readline() for i in range(6)]
+        if not lines[5].endswith(b'\n'):
+            return False
+        mesa = MesaProfile()
+        mesa.inProfileName = self.inHistoryName
+        self.head_fields = lines[1].decode().split()
+        self.head = mesa.fillDict(OrderedDict([]), self.head_fields, lines[2].decode().split())
+        self.zone_fields = lines[5].decode().split()
+        mesa.zone_fields = self.zone_fields
+        self.usecols = mesa.getColumnIndices(self.columns)
+        self.data_fields = [self.zone_fields[i] for i in self.usecols]
+        self.usecols.append(mesa.getColumnIndices(['model_number'])[0])
+        self.data = np.empty((len(self.usecols), self.capacity), dtype=np.float64)
+        self.offset = fin.tell()
+        return True
+
+    def refresh(self):
+        ## Parse the lines appended to the file since the last refresh
+        ## and return the number of new rows.
+        ## A trailing line without a newline is left for the next refresh.
+        try:
+            size = os.path.getsize(self.inHistoryName)
+        except OSError:
+            return 0
+        if self.offset is not None and size < self.offset:
+            # The file was truncated or replaced, start over
+            self.reset()
+        fin = open(self.inHistoryName, 'rb')
+        try:
+            if self.offset is None and not self.readHeader(fin):
+                return 0
+            fin.seek(self.offset)
+            new = fin.read(size - self.offset)
+        finally:
+            fin.close()
+        new = new[:new.rfind(b'\n')+1]
+        if not new:
+            return 0
+        block = np.loadtxt(new.decode().splitlines(), dtype=np.float64,
+                           usecols=self.usecols, ndmin=2)
+        # Only lines parsed and appended are consumed: if parsing fails,
+        # the next refresh reads them again
+        if block.shape[0] != 0:
+            self.append(block.T)
+        self.offset += len(new)
+        return block.shape[0]
+
+    def append(self, block):
+        ## Append block of shape (fields, rows), the last field being model_number.
+        ## A row whose model number is not above that of every earlier row
+        ## replaces those rows, as happens after MESA retries or backups.
+        mn = block[-1]
+        # Keep new rows whose model number is below that of all later new rows
+        later_min = np.minimum.accumulate(mn[::-1])[::-1]
+        keep = np.ones(len(mn), dtype=bool)
+        keep[:-1] = mn[:-1] < later_min[1:]
+        block = block[:,keep]
+        # Drop old rows at or after the first new model number
+        self.nrows = np.searchsorted(self.data[-1,:self.nrows], later_min[0], 'left')
+
+        n = self.nrows + block.shape[1]
+        if n > self.data.shape[1]:
+            # Grow the arrays geometrically so appends are amortized O(1) per row
+            capacity = max(n, 2*self.data.shape[1])
+            data = np.empty((self.data.shape[0], capacity), dtype=np.float64)
+            data[:,:self.nrows] = self.data[:,:self.nrows]
+            self.data = data
+        self.data[:,self.nrows:n] = block
+        self.nrows = n
+
+        for i, f in enumerate(self.data_fields):
+            self.star[f] = self.data[i,:self.nrows]
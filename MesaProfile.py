@@ -18,33 +18,196 @@ This file is part of mesa2flash.
     You should have received a copy of the GNU General Public License
     along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
 """
+import os
+import itertools
 import numpy as np
+from multiprocessing import Pool, cpu_count
 from collections import OrderedDict
-from elements import PeriodicTable
+from elements import PeriodicTable, UnidentifiedElement
+import elements
+from MesaCache import MesaCache
 
 cmperRsun = 6.955e10 # centimeters per solar radius
 
+def seekData(fb):
+    ## Skip the 6 header lines of the binary file fb
+    ## and return the byte offset of the first line of data
+    for i in range(6):
+        fb.readline()
+    return fb.tell()
+
+def parseByteRange(args):
+    ## Parse the fields with indices usecols from the lines in bytes [a,b)
+    ## of file pname into a float64 array of shape (rows, fields), in file order.
+    ## a and b must be at line boundaries
+    pname, a, b, usecols = args
+    fb = open(pname,'rb')
+    fb.seek(a)
+    lines = fb.read(b-a).decode().splitlines()
+    fb.close()
+    if not lines:
+        return np.empty((0, len(usecols)), dtype=np.float64)
+    return np.loadtxt(lines, dtype=np.float64, usecols=usecols, ndmin=2)
+
+class MesaStar(OrderedDict):
+    ## The star data structure: a dictionary of numpy arrays, one per field.
+    ## Fields in the registry of derived fields (see register) are computed
+    ## from their dependencies the first time they are read and then kept.
+    ## Replacing or deleting a field forgets the derived fields depending on it,
+    ## which are recomputed on their next read.
+
+    ## Derived fields: name -> (names of the fields it depends on, function
+    ## of the star returning the field)
+    derived = OrderedDict([])
+
+    @classmethod
+    def register(cls, name, depends, func):
+        ## Add the derived field name, computed as func(star) from the fields depends
+        cls.derived[name] = (list(depends), func)
+
+    def __init__(self, *args, **kwargs):
+        ## memo: names of the derived fields computed and kept so far
+        self.memo = set()
+        OrderedDict.__init__(self, *args, **kwargs)
+
+    def __missing__(self, k):
+        if k not in self.derived:
+            raise KeyError(k)
+        depends, func = self.derived[k]
+        for d in depends:
+            if d not in self and d not in self.derived:
+                raise KeyError(k + ' needs field ' + d)
+        v = func(self)
+        OrderedDict.__setitem__(self, k, v)
+        self.memo.add(k)
+        return v
+
+    def get(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            return default
+
+    def __setitem__(self, k, v):
+        OrderedDict.__setitem__(self, k, v)
+        ## A field set explicitly is no longer a derived one
+        self.memo.discard(k)
+        self.invalidate(k)
+
+    def __delitem__(self, k):
+        OrderedDict.__delitem__(self, k)
+        self.memo.discard(k)
+        self.invalidate(k)
+
+    ## The other ways of removing or adding fields go through the same bookkeeping
+
+    def pop(self, k, *default):
+        if k not in self:
+            if default:
+                return default[0]
+            raise KeyError(k)
+        v = OrderedDict.__getitem__(self, k)
+        del self[k]
+        return v
+
+    def popitem(self, last=True):
+        k, v = OrderedDict.popitem(self, last)
+        self.memo.discard(k)
+        self.invalidate(k)
+        return k, v
+
+    def clear(self):
+        OrderedDict.clear(self)
+        self.memo.clear()
+
+    def setdefault(self, k, default=None):
+        try:
+            return self[k]
+        except KeyError:
+            self[k] = default
+            return default
+
+    def invalidate(self, k):
+        ## Forget the computed derived fields depending, directly or not, on field k
+        for d in list(self.memo):
+            if d in self.memo and k in self.derived[d][0]:
+                self.memo.discard(d)
+                if d in self:
+                    OrderedDict.__delitem__(self, d)
+                self.invalidate(d)
+
+    def __reduce__(self):
+        ## Pickle as a plain dictionary of the fields present
+        return (self.__class__, (list(self.items()),))
+
+def innerRadius(star):
+    ## Inner radius of each zone: 'radius' is the outer cell boundary of each
+    ## zone, and the inner radius of the innermost zone (MESA's R_center) is assumed to be 0
+    r = np.zeros(len(star['radiuscm']))
+    r[1:] = star['radiuscm'][:-1]
+    return r
+
+## radiuscm: radius in cm instead of Rsun units
+MesaStar.register('radiuscm', ['radius'], lambda s: cmperRsun*s['radius'])
+## rcminner: inner radius of each zone in cm
+MesaStar.register('rcminner', ['radiuscm'], innerRadius)
+## rad_cm_ctr: volume-centered radius of each zone in cm
+MesaStar.register('rad_cm_ctr', ['radiuscm', 'rcminner'],
+                  lambda s: (0.5*(s['radiuscm']**3 + s['rcminner']**3))**(1.0/3.0))
+## density: density in g/cm^3
+MesaStar.register('density', ['logRho'], lambda s: 10.0**s['logRho'])
+## volume: volume of each zone in cm^3
+MesaStar.register('volume', ['radiuscm', 'rcminner'],
+                  lambda s: ((4.0*np.pi/3.0)*(s['radiuscm']**2 + s['radiuscm']*s['rcminner'] + s['rcminner']**2)*
+                             (s['radiuscm']-s['rcminner'])))
+
 class MesaProfile:
-    def __call__(self, pname=None):
-        self.__init__(pname)
+    def __call__(self, pname=None, keep_zones=False, columns=None, last_row=False, cache=None,
+                 header_only=False):
+        self.__init__(pname, keep_zones, columns, last_row, cache, header_only)
         
-    def __init__(self, pname=None):
+    def __init__(self, pname=None, keep_zones=False, columns=None, last_row=False, cache=None,
+                 header_only=False):
         self.inProfileName = pname
+        ## If columns is a list of field names, only those fields are read
+        self.columns = columns
+        ## If last_row is True, only the header and the final data line of a
+        ## history file are read (see readLastRow)
+        self.last_row = last_row
+        ## If header_only is True, only the header lines are read (see readHeaderOnly)
+        self.header_only = header_only
+        ## cache is a MesaCache to keep parsed data in, True to use a MesaCache
+        ## with default settings, False to never cache, or None to use the
+        ## cache configured by the environment if any (see MesaCache)
+        self.cache = cache
 
         # Data structures
         ## The header is stored as a dictionary
         self.head = OrderedDict([])
         self.head_fields = []
-        ## The zone data is stored as a list of dictionaries
-        self.zone = []
+        ## The zone data is stored as a single 2D array of shape (fields, zones)
+        ## with row i holding the values of zone_fields[i] ordered from r=0 outward
+        self.data = np.empty((0, 0), dtype=np.float64)
+        self.data_is_int = []
+        self.data_fields = []
         self.zone_fields = []
-        ## The star data structure is a dictionary of numpy arrays
-        self.star = OrderedDict([])
+        ## The zone data as a list of dictionaries is only kept if keep_zones=True
+        self.keep_zones = keep_zones
+        self.zone = []
+        ## The star data structure is a dictionary of numpy arrays (see MesaStar)
+        self.star = MesaStar()
+        ## Isotope fields found in the data (see indexIsotopes)
+        self.isotopes = OrderedDict([])
+        self.abundances = None
 
         if pname:
             self.setInProfileName(pname)
-            if 'profile' in pname:
+            if header_only:
+                self.readHeaderOnly()
+            elif 'profile' in pname:
                 self.readProfile()
+            elif 'history' in pname and last_row:
+                self.readLastRow()
             elif 'history' in pname:
                 self.readHistory()
             else:
@@ -58,21 +221,68 @@ class MesaProfile:
         return self.star
 
     def getIsotopes(self):
-        list_of_isotopes = []
-        for element in PeriodicTable.table.keys():
-            element_symbol = element.lower()
-            for massnumber in range(1, 1000):
-                isotope_symbol = '{}{}'.format(element_symbol, massnumber)
-                if isotope_symbol in self.star.keys():
-                    list_of_isotopes.append(isotope_symbol)
-        return list_of_isotopes
+        # Return the isotope fields ordered by Z, then A
+        return [i.name for i in sorted(self.isotopes.values(), key=lambda i: (i.Z, i.A))]
+
+    def indexIsotopes(self):
+        ## Find the isotope fields (e.g. 'c12') once, by matching the field
+        ## names against the PeriodicTable. self.isotopes maps each isotope
+        ## name, in file order, to an Isotope holding its Z, A and row in self.data.
+        self.isotopes = OrderedDict([])
+        self.abundances = None
+        for j, f in enumerate(self.data_fields):
+            try:
+                self.isotopes[f] = PeriodicTable.lookup_isotope(f, column=j)
+            except UnidentifiedElement:
+                pass
+        return self.isotopes
+
+    def getAbundances(self):
+        ## Return the mass fractions of all isotopes as a 2D array of shape
+        ## (zones, isotopes), with isotopes in the order of self.isotopes.
+        ## This is a view into self.data when the isotope fields are adjacent.
+        if self.abundances is None:
+            cols = [i.column for i in self.isotopes.values()]
+            if cols and cols == list(range(cols[0], cols[0]+len(cols))):
+                self.abundances = self.data[cols[0]:cols[0]+len(cols)].T
+            else:
+                self.abundances = self.data[cols].T
+        return self.abundances
+
+    def getIsotopeVectors(self):
+        ## Return (Z, A), arrays of the charge and mass number of each isotope
+        ## aligned with the columns of getAbundances
+        return PeriodicTable.isotope_vectors(list(self.isotopes.keys()))
+
+    def getYe(self):
+        ## Return the electron fraction of each zone computed from the isotopes
+        ## (to check against MESA's ye field)
+        Z, A = self.getIsotopeVectors()
+        return elements.ye(self.getAbundances(), Z, A)
+
+    def getAbar(self):
+        ## Return the mean mass number of each zone
+        Z, A = self.getIsotopeVectors()
+        return elements.abar(self.getAbundances(), Z, A)
+
+    def getZbar(self):
+        ## Return the mean charge of each zone
+        Z, A = self.getIsotopeVectors()
+        return elements.zbar(self.getAbundances(), Z, A)
+
+    def getMassFractionSum(self):
+        ## Return the sum of the isotope mass fractions of each zone
+        return elements.mass_fraction_sum(self.getAbundances())
 
     def fillDict(self,d,k,v):
         ## Fill a dictionary given a list of keys and values
         ## Typecast values as either int or float depending on the presence of a '.'
+        ## Quoted values (e.g. version_number in recent MESA versions) are kept as strings
         for i in range(0,len(k)):
             # Detect float vs int and typecast accordingly
-            if (v[i].find('.') == -1): # value is an int
+            if v[i].startswith('"'): # value is a string
+                d[k[i]] = v[i].strip('"')
+            elif (v[i].find('.') == -1): # value is an int
                 d[k[i]] = int(v[i])
             else: # value is a float
                 d[k[i]] = float(v[i])
@@ -98,34 +308,278 @@ class MesaProfile:
         # Return star data structure
         return s
 
-    def readProfile(self):
-        # Open mesa profile
-        self.fin = open(self.inProfileName,'r')
-
-        # Read mesa profile into data structures for header and zones
-        ## Get indices for header fields
+    def readHeader(self):
+        ## Read the header lines common to profile and history files,
+        ## leaving self.fin positioned at the first line of zone data.
         self.fin.readline()
         self.head_fields = self.fin.readline()
         self.head_fields = self.head_fields.split()
         self.head_values = self.fin.readline()
         self.head_values = self.head_values.split()
         self.head = self.fillDict(OrderedDict([]),self.head_fields,self.head_values)
-        # Read zone data from profile into structure zone
         self.fin.readline()
         self.fin.readline()
         self.zone_fields = self.fin.readline()
         self.zone_fields = self.zone_fields.split()
-        for l in self.fin:
-            self.zone.append(self.fillDict(OrderedDict([]),self.zone_fields,l.split()))
 
-        # Profile has been fully read into memory, close it
+    def getColumnIndices(self,columns):
+        ## Map a list of field names to their indices in self.zone_fields,
+        ## all fields if columns is None.
+        if columns is None:
+            return list(range(len(self.zone_fields)))
+        missing = [c for c in columns if not c in self.zone_fields]
+        if missing:
+            raise ValueError('fields not found in {}: {}'.format(self.inProfileName, ' '.join(missing)))
+        return [self.zone_fields.index(c) for c in columns]
+
+    def readHeaderOnly(self):
+        # Read only the header lines of a profile or history file,
+        # the data block is never touched. The header values are
+        # stored in star and the field names in zone_fields.
+        self.fin = open(self.inProfileName,'r')
+        self.readHeader()
+        self.fin.close()
+        self.star = MesaStar()
+        for k in self.head.keys():
+            self.star[k] = self.head[k]
+
+    def readBlock(self,usecols,reverse=True):
+        ## Parse the fields with indices usecols from the rest of self.fin
+        ## into a 2D float64 array of shape (fields, zones).
+        ## Unrequested fields are never converted.
+        ## NOTE: if reverse, rows are reversed so lower indices are closer to r=0,
+        ## contrary to MESA zone indexing (MESA starts indexing zones at edge of star).
+        ## Also returns a list of booleans, True where a field holds integers,
+        ## using the same '.' rule as fillDict on the first line of data.
+        pos = self.fin.tell()
+        first = self.fin.readline().split()
+        self.fin.seek(pos)
+        if not first:
+            return np.empty((len(usecols), 0), dtype=np.float64), [False for i in usecols]
+        is_int = [first[i].find('.') == -1 for i in usecols]
+        block = np.loadtxt(self.fin, dtype=np.float64, usecols=usecols, ndmin=2)
+        if reverse:
+            block = block[::-1]
+        block = np.ascontiguousarray(block.T)
+        return block, is_int
+
+    def iterBlocks(self,usecols,chunk_rows=10000):
+        ## Generator over the rest of self.fin, parsing the fields with
+        ## indices usecols into 2D float64 arrays of shape (rows, fields)
+        ## holding at most chunk_rows rows each.
+        while True:
+            lines = list(itertools.islice(self.fin, chunk_rows))
+            if not lines:
+                return
+            block = np.loadtxt(lines, dtype=np.float64, usecols=usecols, ndmin=2)
+            if block.shape[0] > 0:
+                yield block
+
+    def stackBlocks(self,blocks):
+        ## Assemble (rows, fields) blocks into one array of shape (fields, rows)
+        blocks = list(blocks)
+        if not blocks:
+            return np.empty((len(self.data_fields), 0), dtype=np.float64)
+        b = np.empty((blocks[0].shape[1], sum([len(bi) for bi in blocks])), dtype=np.float64)
+        i = 0
+        while blocks:
+            bi = blocks.pop(0)
+            b[:,i:i+len(bi)] = bi.T
+            i += len(bi)
+        return b
+
+    def iterHistory(self,chunk_rows=10000,columns=None):
+        ## Generator over the data in a history file in blocks of at most
+        ## chunk_rows rows, so reductions over large histories can run in
+        ## bounded memory. Each block is a numpy structured array with
+        ## one float64 field per column, e.g. block['star_age'].
+        ## columns defaults to self.columns (all fields if None).
+        if columns is None:
+            columns = self.columns
+        self.fin = open(self.inProfileName,'r')
+        try:
+            self.readHeader()
+            usecols = self.getColumnIndices(columns)
+            dtype = np.dtype([(self.zone_fields[i], np.float64) for i in usecols])
+            for block in self.iterBlocks(usecols, chunk_rows):
+                yield block.view(dtype).reshape(block.shape[0])
+        finally:
+            self.fin.close()
+
+    def block2star(self,b,is_int,s):
+        # Fill the star data structure with views into the rows of b,
+        # casting the integer fields back to integer arrays.
+        for i, f in enumerate(self.data_fields):
+            if is_int[i]:
+                s[f] = b[i].astype(np.int64)
+            else:
+                s[f] = b[i]
+        return s
+
+    def block2zone(self,b,is_int):
+        # Rebuild the list of per-zone dictionaries in MESA zone order
+        z = []
+        for j in range(b.shape[1]-1, -1, -1):
+            d = OrderedDict([])
+            for i, f in enumerate(self.data_fields):
+                if is_int[i]:
+                    d[f] = int(b[i,j])
+                else:
+                    d[f] = float(b[i,j])
+            z.append(d)
+        return z
+
+    def getCache(self):
+        ## Return the MesaCache to use for this file, or None
+        if self.cache is None:
+            return MesaCache.fromEnvironment()
+        elif self.cache is False:
+            return None
+        elif self.cache is True:
+            cache = MesaCache()
+        else:
+            cache = self.cache
+        if not cache.enabled:
+            return None
+        return cache
+
+    def readData(self,reverse):
+        ## Read the header and the requested fields of the data block,
+        ## from the binary cache if it holds a valid copy of the file.
+        cache = self.getCache()
+        if cache is not None:
+            cached = cache.load(self.inProfileName)
+            if cached is not None:
+                m, data = cached
+                if m['reverse'] == reverse and (self.columns is None or
+                                                all([c in m['fields'] for c in self.columns])):
+                    self.head_fields = m['head_fields']
+                    self.head = m['head']
+                    self.zone_fields = m['zone_fields']
+                    if self.columns is None:
+                        self.data_fields = m['fields']
+                        self.data = data
+                        self.data_is_int = m['is_int']
+                    else:
+                        idx = [m['fields'].index(c) for c in self.columns]
+                        self.data_fields = list(self.columns)
+                        self.data = data[idx]
+                        self.data_is_int = [m['is_int'][i] for i in idx]
+                    return
+            # On a cache miss, parse all fields so the cache entry is complete
+            stat = os.stat(self.inProfileName)
+
+        self.fin = open(self.inProfileName,'r')
+        self.readHeader()
+        if cache is None:
+            usecols = self.getColumnIndices(self.columns)
+        else:
+            usecols = self.getColumnIndices(None)
+            # Still check the requested fields exist before parsing
+            self.getColumnIndices(self.columns)
+        self.data_fields = [self.zone_fields[i] for i in usecols]
+        if reverse:
+            self.data, self.data_is_int = self.readBlock(usecols, reverse)
+        else:
+            self.data = self.stackBlocks(self.iterBlocks(usecols))
+            self.data_is_int = [False for i in usecols]
+        self.fin.close()
+
+        if cache is not None:
+            cache.save(self.inProfileName, stat,
+                       OrderedDict([('reverse', reverse),
+                                    ('head_fields', self.head_fields),
+                                    ('head', self.head),
+                                    ('zone_fields', self.zone_fields),
+                                    ('fields', self.data_fields),
+                                    ('is_int', self.data_is_int)]),
+                       self.data)
+            if self.columns is not None:
+                idx = self.getColumnIndices(self.columns)
+                self.data_fields = list(self.columns)
+                self.data = self.data[idx]
+                self.data_is_int = [self.data_is_int[i] for i in idx]
+
+    def getByteRanges(self,nparts):
+        ## Split the data block into nparts byte ranges [a,b) aligned to line
+        ## boundaries, and return them with the first line of data.
+        fb = open(self.inProfileName,'rb')
+        start = seekData(fb)
+        first = fb.readline().decode().split()
+        fb.seek(0,2)
+        end = fb.tell()
+        bounds = [start]
+        for i in range(1,nparts):
+            p = max(start + ((end-start)*i)//nparts, bounds[-1])
+            if p > start and p < end:
+                # Move the boundary to the start of the next line
+                fb.seek(p-1)
+                fb.readline()
+                p = min(fb.tell(), end)
+            bounds.append(p)
+        bounds.append(end)
+        fb.close()
+        return [(bounds[i], bounds[i+1]) for i in range(nparts)], first
+
+    def readProfileParallel(self,comm=None,processes=None,root=None):
+        # Read mesa profile like readProfile, with each MPI rank of comm
+        # (or each worker of a process pool if comm is None) parsing a
+        # slice of the zone data. The result is bit-identical to readProfile.
+        # If root is None, every rank assembles the profile, otherwise only root does.
+        self.fin = open(self.inProfileName,'r')
+        self.readHeader()
         self.fin.close()
-        # Convert zone data structure to star data structure
-        self.star = self.zone2star(self.zone,self.star)
+        usecols = self.getColumnIndices(self.columns)
+        self.data_fields = [self.zone_fields[i] for i in usecols]
+        nf = len(usecols)
 
-        # Add radius in cm as a field if it doesn't already exist and radius exists
-        if 'radius' in self.star.keys() and not 'radiuscm' in self.star.keys():
-            self.star['radiuscm'] = cmperRsun*self.star['radius']
+        if comm is None:
+            if processes is None:
+                processes = cpu_count()
+            ranges, first = self.getByteRanges(processes)
+            jobs = [(self.inProfileName, a, b, usecols) for (a, b) in ranges]
+            pool = Pool(processes)
+            try:
+                parts = pool.map(parseByteRange, jobs)
+            finally:
+                pool.close()
+                pool.join()
+            rows = np.concatenate(parts) if parts else np.empty((0, nf))
+            assemble = True
+        else:
+            ranges, first = self.getByteRanges(comm.Get_size())
+            a, b = ranges[comm.Get_rank()]
+            part = np.ascontiguousarray(parseByteRange((self.inProfileName, a, b, usecols)))
+            counts = np.array(comm.allgather(part.size), dtype=np.int64)
+            displs = np.zeros(len(counts), dtype=np.int64)
+            displs[1:] = np.cumsum(counts)[:-1]
+            assemble = root is None or comm.Get_rank() == root
+            rows = np.empty((counts.sum()//nf if assemble else 0, nf), dtype=np.float64)
+            if root is None:
+                comm.Allgatherv(part, [rows, (counts, displs)])
+            else:
+                comm.Gatherv(part, [rows, (counts, displs)] if assemble else None, root=root)
+
+        if not assemble:
+            return
+        if first:
+            self.data_is_int = [first[i].find('.') == -1 for i in usecols]
+        else:
+            self.data_is_int = [False for i in usecols]
+        self.data = np.ascontiguousarray(rows[::-1].T)
+        self.fillStar()
+
+    def readProfile(self):
+        # Read mesa profile into data structures for header and zones
+        self.readData(reverse=True)
+        self.fillStar()
+
+    def fillStar(self):
+        # Convert zone data block to star data structure
+        self.star = self.block2star(self.data,self.data_is_int,self.star)
+        self.indexIsotopes()
+        if self.keep_zones:
+            self.zone = self.block2zone(self.data,self.data_is_int)
         
         # Add header to star data structure
         for k in self.head.keys():
@@ -139,30 +593,54 @@ class MesaProfile:
         return num
 
     def readHistory(self):
-        # Open mesa history file
+        # Read mesa history file
+        # NOTE: history values are all read as floats, as str2num does.
+        self.readData(reverse=False)
+        self.tzone_fields = self.zone_fields
+        self.data_is_int = [False for f in self.data_fields]
+        self.star = self.block2star(self.data,self.data_is_int,MesaStar())
+
+    def readLastRow(self,blocksize=4096):
+        # Read only the header and the last complete line of data,
+        # seeking backwards from the end of the file so the cost does not
+        # depend on the number of lines. A trailing line without a newline
+        # (e.g. from a run that is still writing) is ignored, as is any
+        # line without a value for every field.
         self.fin = open(self.inProfileName,'r')
-        
-        self.fin.readline()
-        self.head_fields = self.fin.readline()
-        self.head_fields = self.head_fields.split()
-        self.head_values = self.fin.readline()
-        self.head_values = self.head_values.split()
-        self.head = self.fillDict(OrderedDict([]),self.head_fields,self.head_values)
-        
-        self.fin.readline()
-        self.fin.readline()
+        self.readHeader()
+        self.fin.close()
+        self.tzone_fields = self.zone_fields
+        usecols = self.getColumnIndices(self.columns)
+        self.data_fields = [self.zone_fields[i] for i in usecols]
+        nf = len(self.zone_fields)
+
+        fb = open(self.inProfileName,'rb')
+        start = seekData(fb)
+        fb.seek(0,2)
+        end = fb.tell()
+        buf = b''
+        pos = end
+        values = None
+        while values is None and pos > start:
+            step = min(blocksize, pos-start)
+            pos = pos-step
+            fb.seek(pos)
+            buf = fb.read(step) + buf
+            # Drop the partial line at the end of the file
+            lines = buf[:buf.rfind(b'\n')+1].split(b'\n')
+            # lines[0] may be incomplete unless we have reached the data start
+            if pos > start:
+                lines = lines[1:]
+            for l in reversed(lines):
+                ls = l.split()
+                if len(ls) == nf:
+                    values = ls
+                    break
+        fb.close()
 
-        # Read time series data from the rest of the file
-        self.tzone_fields = self.fin.readline()
-        self.tzone_fields = self.tzone_fields.split()
-        self.star = OrderedDict([])
-        for tzf in self.tzone_fields:
-            self.star[tzf] = []
-        for l in self.fin:
-            ls = l.split()
-            for k,v in zip(self.tzone_fields,ls):
-                self.star[k].append(self.str2num(v))
-        # now convert to np arrays
-        for k in self.star.keys():
-            self.star[k] = np.array(self.star[k])
-			
+        if values is None:
+            self.data = np.empty((len(usecols), 0), dtype=np.float64)
+        else:
+            self.data = np.array([[float(values[i])] for i in usecols], dtype=np.float64)
+        self.data_is_int = [False for i in usecols]
+        self.star = self.block2star(self.data,self.data_is_int,MesaStar())
@@ -0,0 +1,138 @@
+"""
+This class answers point queries of a MESA profile at arbitrary radii or
+enclosed masses.
+
+Everything a query needs is computed once when the MesaQuery is built:
+the sorted zone coordinates, the cumulative mass and volume of the zones,
+and the coefficients of a polynomial fit between each pair of neighboring
+zone centers, of the same orders and stencils UniformMesaGrid.py uses to
+interpolate (1 = linear, 2 = quadratic, 3 = cubic). The fits are made in
+a coordinate local to each pair of zones, as in the remap, so they agree
+with the remap's fits and do not become singular. A batch of queries is
+then a binary search and a vectorized evaluation.
+
+Usage:
+    mesa = MesaProfile('profile75.data')
+    query = MesaQuery(mesa, poly_n=2)
+    q = query.at(radius=np.array([1.0e7, 2.0e8]))
+    rho = q['density']
+    q = query.at(mass=0.5*query.total_mass)
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from collections import OrderedDict
+from MesaRemap import star_geometry, fit_stencils, evaluate_fits
+
+class MesaQuery(object):
+    def __init__(self, star, poly_n=1, vars=None):
+        ## star: a MesaProfile, or its star data structure
+        ## poly_n: interpolation order, 1 = linear, 2 = quadratic, 3 = cubic
+        ## vars: names of the fields to interpolate, default density,
+        ##       temperature, ye and the isotopes of the MesaProfile
+        isotopes = []
+        if hasattr(star, 'star'):
+            isotopes = list(star.isotopes.keys())
+            star = star.star
+        if vars is None:
+            vars = ['density', 'temperature', 'ye'] + isotopes
+        star = star_geometry(star)
+        self.vars = list(vars)
+        self.poly_n = poly_n
+
+        ## Zone inner and outer radii, centers and densities, increasing outward
+        self.rcminner = np.asarray(star['rcminner'], dtype=np.float64)
+        self.radiuscm = np.asarray(star['radiuscm'], dtype=np.float64)
+        self.rad_cm_ctr = np.asarray(star['rad_cm_ctr'], dtype=np.float64)
+        self.density = np.asarray(star['density'], dtype=np.float64)
+        self.values = np.column_stack([star[v] for v in self.vars]).astype(np.float64)
+        npts = len(self.radiuscm)
+        if npts < poly_n+1:
+            raise ValueError('need at least ' + str(poly_n+1) + ' zones to interpolate with order ' + str(poly_n))
+
+        ## Volume and mass enclosed by the inner edge of each zone and the
+        ## surface: vcum[j], mcum[j] for j = 0..npts
+        self.vcum = np.zeros(npts+1)
+        self.vcum[1:] = np.cumsum(star['volume'])
+        self.mcum = np.zeros(npts+1)
+        self.mcum[1:] = np.cumsum(self.density*star['volume'])
+        self.total_mass = self.mcum[-1]
+
+        ## Fit coefficients between the zone centers k and k+1, for k = 0..npts-2,
+        ## in the coordinate (r - rad_cm_ctr[k])/(rad_cm_ctr[k+1] - rad_cm_ctr[k])
+        k = np.arange(npts-1)
+        self.origin = self.rad_cm_ctr[:-1]
+        self.scale = self.rad_cm_ctr[1:] - self.rad_cm_ctr[:-1]
+        self.coeffs = fit_stencils(self.rad_cm_ctr, self.values, k, k+1, poly_n,
+                                   origin=self.origin, scale=self.scale)
+
+    def zoneOf(self, radius):
+        ## Index of the zone containing each radius, clipped to the star
+        return np.clip(np.searchsorted(self.radiuscm, radius, 'left'), 0, len(self.radiuscm)-1)
+
+    def enclosedVolume(self, radius):
+        ## Volume in cm^3 enclosed by each radius, clipped to the star
+        radius = np.clip(radius, self.rcminner[0], self.radiuscm[-1])
+        j = self.zoneOf(radius)
+        return self.vcum[j] + (4.0*np.pi/3.0)*(radius**3 - self.rcminner[j]**3)
+
+    def enclosedMass(self, radius):
+        ## Mass in g enclosed by each radius, clipped to the star, with the
+        ## density constant within each zone
+        radius = np.clip(radius, self.rcminner[0], self.radiuscm[-1])
+        j = self.zoneOf(radius)
+        return self.mcum[j] + self.density[j]*(4.0*np.pi/3.0)*(radius**3 - self.rcminner[j]**3)
+
+    def massRadius(self, mass):
+        ## Radius in cm enclosing each mass in g (the inverse of enclosedMass)
+        mass = np.clip(mass, 0.0, self.total_mass)
+        j = np.clip(np.searchsorted(self.mcum, mass, 'right')-1, 0, len(self.radiuscm)-1)
+        return np.cbrt(self.rcminner[j]**3 + (mass - self.mcum[j])/((4.0*np.pi/3.0)*self.density[j]))
+
+    def at(self, radius=None, mass=None):
+        ## Interpolate vars at the given radii in cm, or at the radii enclosing
+        ## the given masses in g. Between two zone centers the fit of that
+        ## pair of zones is used, extended beyond the innermost and outermost
+        ## centers, and a query at a zone center returns that zone's values.
+        ## Radii outside the star are clipped to its inner and outer edges, as
+        ## masses are clipped to [0, total_mass], so such queries return the
+        ## values at the edge rather than an unbounded extrapolation.
+        ## Returns a dictionary of arrays with 'radius' (clipped), 'mass' and each of vars.
+        if (radius is None) == (mass is None):
+            raise ValueError('give either radius or mass')
+        if radius is None:
+            mass = np.atleast_1d(np.asarray(mass, dtype=np.float64))
+            radius = self.massRadius(mass)
+        else:
+            radius = np.atleast_1d(np.asarray(radius, dtype=np.float64))
+            radius = np.clip(radius, self.rcminner[0], self.radiuscm[-1])
+            mass = self.enclosedMass(radius)
+
+        k = np.clip(np.searchsorted(self.rad_cm_ctr, radius, 'right')-1, 0, len(self.rad_cm_ctr)-2)
+        values = evaluate_fits(self.coeffs[k], (radius - self.origin[k])/self.scale[k])
+        ## Zone centers take the zone values, as in the remap
+        for j in (k, k+1):
+            center = self.rad_cm_ctr[j] == radius
+            values[center] = self.values[j[center]]
+
+        q = OrderedDict([])
+        q['radius'] = radius
+        q['mass'] = mass
+        for n, v in enumerate(self.vars):
+            q[v] = values[:,n]
+        return q
@@ -0,0 +1,875 @@
+"""
+This module provides the array routines used to remap a MESA profile
+onto a uniform grid (see UniformMesaGrid.py) or any grid of increasing
+interval edges, and the MesaRemapper class which remaps a profile in
+memory at one or more grid resolutions.
+
+Usage:
+    mesa = MesaProfile('profile75.data')
+    remapper = MesaRemapper(mesa, poly_n=2)
+    grids = remapper.remap([1.0e5, 2.0e5, 4.0e5])
+    rho = grids[0]['density']
+    remapper.remapStream(1.0e4, 'profile75.uniform.dat')
+    grid = remapper.remapEdges(remapper.massEdges(1000))
+
+To remap many profiles onto one grid definition, see remap_profiles.
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import time
+import math
+import numpy as np
+from multiprocessing import Pool, cpu_count
+from collections import OrderedDict
+from MesaProfile import MesaProfile, MesaStar
+from MapMesaComposition import MapMesaComposition, renormalize
+
+def find_overlaps(rcminner, radiuscm, rad_cm_inn, rad_cm_out):
+    # Find which MESA zones fall into which grid intervals & vice-versa.
+    # rcminner, radiuscm: inner and outer radii of the MESA zones, increasing
+    # rad_cm_inn, rad_cm_out: inner and outer radii of the grid intervals, increasing
+    # Since both are sorted, this is a binary search per grid edge
+    # instead of a comparison of every zone with every interval.
+    #
+    # Returns (cont_lo, cont_hi, empty, empty_zones):
+    # cont_lo, cont_hi: the MESA zones j with rcminner[j] >= rad_cm_inn[i] and
+    #                   radiuscm[j] <= rad_cm_out[i] are cont_lo[i] <= j < cont_hi[i]
+    # empty: indices i of the grid intervals containing no MESA zone
+    # empty_zones: for each interval in empty, the (at most 2, increasing)
+    #              MESA zones straddling its edges, padded with -1
+    npts = len(radiuscm)
+    cont_lo = np.searchsorted(rcminner, rad_cm_inn, 'left')
+    cont_hi = np.searchsorted(radiuscm, rad_cm_out, 'right')
+    empty = np.nonzero(cont_hi <= cont_lo)[0]
+
+    # Zones j with rcminner[j] < r < radiuscm[j], for r at each edge of the empty intervals
+    empty_zones = np.full((len(empty), 2), -1, dtype=np.int64)
+    for e, redge in enumerate([rad_cm_inn[empty], rad_cm_out[empty]]):
+        j = np.searchsorted(radiuscm, redge, 'right')
+        jc = np.minimum(j, npts-1)
+        straddles = (j < npts) & (rcminner[jc] < redge)
+        empty_zones[straddles,e] = j[straddles]
+    # Keep a zone straddling both edges once, and list the zones first
+    same = empty_zones[:,0] == empty_zones[:,1]
+    empty_zones[same,1] = -1
+    first_missing = empty_zones[:,0] == -1
+    empty_zones[first_missing,0] = empty_zones[first_missing,1]
+    empty_zones[first_missing,1] = -1
+    return cont_lo, cont_hi, empty, empty_zones
+
+def zone_window(rcminner, radiuscm, r_inn, r_out, halo=3):
+    # Return (jlo, jhi) such that the MESA zones jlo <= j < jhi include all
+    # zones overlapping the radii [r_inn, r_out] plus halo zones on either
+    # side, as needed to remap grid intervals spanning [r_inn, r_out]
+    # (the interpolation stencils reach 3 zones beyond the overlapping zones).
+    npts = len(radiuscm)
+    jlo = np.searchsorted(radiuscm, r_inn, 'right') - halo
+    jhi = np.searchsorted(rcminner, r_out, 'left') + halo
+    return max(jlo, 0), min(jhi, npts)
+
+def zone_integrals(rcminner, radiuscm, density, values):
+    # Per-zone volume, mass and mass-weighted values of the MESA zones.
+    # Volumes omit the common factor 4*pi/3, which cancels in all averages.
+    # values: array of shape (zones, variables)
+    # Returns (kVol, kMass, kData), kData having the shape of values.
+    ri = rcminner
+    ro = radiuscm
+    kVol = (ro**2 + ro*ri + ri**2)*(ro-ri)
+    kMass = density*kVol
+    kData = kMass[:,None]*values
+    return kVol, kMass, kData
+
+def mass_average(rcminner, radiuscm, density, values, rad_cm_inn, rad_cm_out,
+                 cont_lo, cont_hi, start=0, integrals=None):
+    # Conservatively average the MESA zones onto the grid intervals which
+    # contain at least one zone (see find_overlaps for cont_lo, cont_hi).
+    # values: array of shape (zones, variables) of quantities to mass-average
+    # start: index of the first interval in the whole grid. The first interval
+    #        of the whole grid gets no contribution from the zone to its left.
+    # integrals: zone_integrals(rcminner, radiuscm, density, values), if already computed
+    # The zones may be a slice of the star (see zone_window) including at least
+    # one zone beyond those overlapping the intervals, unless it ends the star.
+    #
+    # Each interval gets the zones it contains plus the parts of the zones
+    # straddling its edges. As in the original per-interval loop, the last
+    # contained zone is not part of the interior sum: the right edge
+    # contribution starts at the zone after it.
+    #
+    # Returns (rho, avg): the density and the mass-averaged values in each
+    # interval, NaN in the intervals containing no zone.
+    npts = len(radiuscm)
+    if integrals is None:
+        integrals = zone_integrals(rcminner, radiuscm, density, values)
+    kVol, kMass, kData = integrals
+
+    full = np.nonzero(cont_hi > cont_lo)[0]
+    lo = cont_lo[full]
+    hi = cont_hi[full]
+
+    ## Left edge: the part of zone lo-1 above rad_cm_inn
+    kl = np.maximum(lo-1, 0)
+    has_left = (full+start != 0) & (rad_cm_inn[full] != rcminner[lo])
+    ri = rad_cm_inn[full]
+    ro = radiuscm[kl]
+    leftVol = np.where(has_left, (ri**2 + ri*ro + ro**2)*(ro-ri), 0.0)
+    leftMass = np.where(has_left, density[kl]*leftVol, 0.0)
+    leftData = np.where(has_left[:,None], values[kl]*leftMass[:,None], 0.0)
+
+    ## Right edge: the part of zone hi below rad_cm_out
+    kr = np.minimum(hi, npts-1)
+    ro = rad_cm_out[full]
+    ri = rcminner[kr]
+    has_right = (hi != npts) & (ri < ro)
+    rightVol = np.where(has_right, (ro**2 + ro*ri + ri**2)*(ro-ri), 0.0)
+    rightMass = np.where(has_right, density[kr]*rightVol, 0.0)
+    rightData = np.where(has_right[:,None], values[kr]*rightMass[:,None], 0.0)
+
+    ## Interior: sums over zones lo <= k < hi-1, computed as segmented sums.
+    ## (Differences of cumulative sums would lose most significant digits
+    ## in the low density envelope, where the mass of an interval is tiny
+    ## compared to the mass enclosed.)
+    has_interior = hi-1 > lo
+    idx = np.empty(2*len(full), dtype=np.int64)
+    idx[0::2] = lo
+    idx[1::2] = hi-1
+    def segment_sum(a):
+        # Where lo == hi-1, reduceat returns a[lo] instead of 0, hence the mask
+        s = np.add.reduceat(a, idx, axis=0)[0::2] if len(idx) else a[:0]
+        mask = has_interior if s.ndim == 1 else has_interior[:,None]
+        return np.where(mask, s, 0.0)
+    intervalVol = segment_sum(kVol)
+    intervalMass = segment_sum(kMass)
+    intervalData = segment_sum(kData)
+
+    sumData = intervalData + leftData + rightData
+    sumMass = leftMass + rightMass + intervalMass
+    sumVol = leftVol + rightVol + intervalVol
+
+    rho = np.full(len(cont_lo), np.nan)
+    avg = np.full((len(cont_lo), values.shape[1]), np.nan)
+    rho[full] = sumMass/sumVol
+    avg[full] = sumData/sumMass[:,None]
+    return rho, avg
+
+def interpolation_stencils(rad_cm_ctr, grid_ctr, empty_zones, zone_start=0, npts=None):
+    # Choose the pair of MESA zones (kB, kC) to interpolate between for each
+    # empty grid interval, given the zones straddling its edges (see find_overlaps).
+    # rad_cm_ctr: MESA zone centers
+    # grid_ctr: centers of the empty grid intervals
+    # zone_start, npts: if rad_cm_ctr holds only the zones zone_start, ...
+    #                   of a star with npts zones, index of its first zone and
+    #                   the total number of zones. Indices are still local.
+    # Returns (kB, kC, inject) where inject marks the intervals whose center
+    # coincides with the center of the single zone they lie in, which take
+    # that zone's values directly (kB is that zone).
+    if npts is None:
+        npts = len(rad_cm_ctr)
+    nz = np.count_nonzero(empty_zones >= 0, axis=1)
+    if np.any(nz == 0):
+        raise ValueError('empty grid interval overlapping no MESA zone')
+    kB = empty_zones[:,0].copy()
+    kC = empty_zones[:,1].copy()
+    inject = np.zeros(len(kB), dtype=bool)
+
+    one = nz == 1
+    k = empty_zones[one,0]
+    g = grid_ctr[one]
+    c = rad_cm_ctr[k]
+    k = k + zone_start
+    below = (k == npts-1) | ((k != 0) & (g < c))
+    above = ~below & ((k == 0) | (g > c))
+    kB[one] = np.where(below, k-1, k) - zone_start
+    kC[one] = np.where(below, k, k+1) - zone_start
+    inject[one] = ~below & ~above
+    return kB, kC, inject
+
+def stencil_zones(kB, kC, poly_n, npts):
+    # The MESA zones used to fit a polynomial of order poly_n between zones kB and kC:
+    # two zones on either side if they exist, otherwise shifted to an extra left or right.
+    # Returns an array of shape (len(kB), poly_n+1)
+    if poly_n == 3:
+        klist = np.column_stack([kB-1,kB,kC,kC+1])
+        first = kB == 0
+        klist[first] = np.column_stack([kB,kC,kC+1,kC+2])[first]
+        last = ~first & (kC == npts-1)
+        klist[last] = np.column_stack([kB-2,kB-1,kB,kC])[last]
+    elif poly_n == 2:
+        klist = np.column_stack([kB-1,kB,kC])
+        first = kB == 0
+        klist[first] = np.column_stack([kB,kC,kC+1])[first]
+    elif poly_n == 1:
+        klist = np.column_stack([kB,kC])
+    else:
+        raise ValueError('poly_n must be 1, 2 or 3')
+    return klist
+
+def interpolate_empty(rad_cm_ctr, values, grid_ctr, empty_zones, poly_n, zone_start=0, npts=None):
+    # Interpolate the MESA zone values onto the empty grid intervals
+    # (see find_overlaps) by least-squares polynomial fits of order poly_n
+    # (1 = linear, 2 = quadratic, 3 = cubic) in radius.
+    # rad_cm_ctr: MESA zone centers
+    # values: array of shape (zones, variables) to interpolate
+    # grid_ctr: centers of the empty grid intervals
+    # zone_start, npts: as for interpolation_stencils, for a slice of the zones
+    #                   which must include 3 zones beyond those straddling the empty intervals.
+    # Empty intervals sharing a stencil (kB, kC) share a fit (see fit_stencils),
+    # made in the coordinate (r - rad_cm_ctr[kB])/(rad_cm_ctr[kC] - rad_cm_ctr[kB]).
+    # In cm the normal equations are too ill-conditioned for the fits to reproduce
+    # the zone values to better than ~1e-5, and cubic fits may be singular.
+    # Returns an array of shape (len(grid_ctr), variables).
+    if npts is None:
+        npts = len(rad_cm_ctr)
+    out = np.empty((len(grid_ctr), values.shape[1]))
+    if len(grid_ctr) == 0:
+        return out
+    kB, kC, inject = interpolation_stencils(rad_cm_ctr, grid_ctr, empty_zones, zone_start, npts)
+    out[inject] = values[kB[inject]]
+    interp = ~inject
+    if not np.any(interp):
+        return out
+
+    stencils, cell_stencil = np.unique(np.column_stack([kB[interp], kC[interp]]),
+                                       axis=0, return_inverse=True)
+    cell_stencil = cell_stencil.reshape(-1)
+    origin = rad_cm_ctr[stencils[:,0]]
+    scale = rad_cm_ctr[stencils[:,1]] - origin
+    coeffs = fit_stencils(rad_cm_ctr, values, stencils[:,0], stencils[:,1], poly_n, zone_start, npts,
+                          origin, scale)
+
+    # Evaluate the fits at the centers of the empty intervals
+    r = (grid_ctr[interp] - origin[cell_stencil])/scale[cell_stencil]
+    out[interp] = evaluate_fits(coeffs[cell_stencil], r)
+    return out
+
+def fit_stencils(rad_cm_ctr, values, kB, kC, poly_n, zone_start=0, npts=None, origin=None, scale=None):
+    # Least-squares polynomial fits of order poly_n in radius to the values
+    # at the MESA zone centers of each stencil around the zones (kB, kC)
+    # (see stencil_zones), all variables at once.
+    # The normal equations of all stencils are solved in one batched call.
+    # zone_start, npts: as for interpolation_stencils
+    # origin, scale: if given, fit in (r - origin)/scale, one per stencil, which
+    #                conditions the normal equations far better than r in cm
+    # Returns coefficients of shape (stencils, poly_n+1, variables), for
+    # r**poly_n, ..., r**0.
+    if npts is None:
+        npts = len(rad_cm_ctr)
+    klist = stencil_zones(kB+zone_start, kC+zone_start, poly_n, npts) - zone_start
+
+    # rpows[s,n,:] = r**n at the points of stencil s, for n = 0..2*poly_n
+    r = rad_cm_ctr[klist]
+    if origin is not None:
+        r = (r - origin[:,None])/scale[:,None]
+    rpows = np.stack([r**n for n in range(0,2*poly_n+1)], axis=1)
+    rsums = rpows.sum(axis=2)
+    # Normal equations for the coefficients of r**poly_n, ..., r**0
+    rmat = np.stack([np.stack([rsums[:,j] for j in range(k+poly_n,k-1,-1)], axis=1)
+                     for k in range(poly_n,-1,-1)], axis=1)
+    # fmat[s,:,v] = sum over points of values[v]*r**j, for j = poly_n..0
+    fvec = values[klist]
+    fmat = np.stack([np.einsum('sp,spv->sv', rpows[:,j], fvec) for j in range(poly_n,-1,-1)], axis=1)
+    return np.linalg.solve(rmat, fmat)
+
+def evaluate_fits(coeffs, r):
+    # Evaluate the polynomial fits coeffs (see fit_stencils), one per point,
+    # at the radii r (in the coordinates of the fit). Returns an array of shape (len(r), variables).
+    poly_n = coeffs.shape[1]-1
+    result = 0.0
+    for j in range(poly_n,-1,-1):
+        result = result + coeffs[:,poly_n-j,:]*(r**j)[:,None]
+    return result
+
+def cell_costs(rcminner, radiuscm, rad_cm_inn, rad_cm_out, interp_cost=4.0):
+    # Estimate the relative work of remapping each grid interval from the
+    # overlap index (see find_overlaps): one unit per interval, plus one per
+    # MESA zone it contains, plus interp_cost for an empty interval, which
+    # needs an interpolation stencil and fit instead of an average.
+    # Returns an array of costs, one per grid interval.
+    cont_lo = np.searchsorted(rcminner, rad_cm_inn, 'left')
+    cont_hi = np.searchsorted(radiuscm, rad_cm_out, 'right')
+    ncont = np.maximum(cont_hi - cont_lo, 0)
+    return 1.0 + ncont + np.where(ncont == 0, interp_cost, 0.0)
+
+def balance_ranges(cost, nparts):
+    # Cut the grid intervals into nparts contiguous ranges of roughly equal
+    # total cost, by bisecting the cumulative cost at multiples of total/nparts.
+    # Returns (counts, starts) as lists: part i gets the intervals
+    # starts[i] <= j < starts[i]+counts[i].
+    ccost = np.cumsum(cost)
+    total = ccost[-1] if len(ccost) else 0.0
+    cuts = np.searchsorted(ccost, total*np.arange(1, nparts)/float(nparts), 'left') + 1
+    bounds = np.concatenate([[0], np.minimum(cuts, len(cost)), [len(cost)]])
+    bounds = np.maximum.accumulate(bounds)
+    counts = [int(n) for n in np.diff(bounds)]
+    starts = [int(n) for n in bounds[:-1]]
+    return counts, starts
+
+def star_geometry(star):
+    # Return star (see MesaProfile) as a MesaStar, whose zone geometry fields
+    # used by the remap are computed from 'radius' and 'logRho' on first use:
+    # radiuscm, rcminner (inner zone radii), rad_cm_ctr (volume-centered zone
+    # radii), density and volume.
+    if isinstance(star, MesaStar):
+        return star
+    return MesaStar(star)
+
+def uniform_grid(r_inn, r_out, Dr):
+    # Return the uniform grid of spacing Dr covering [r_inn, r_out] as an
+    # array of shape (intervals, 3) of inner, center and outer radii,
+    # each a running sum of Dr.
+    ngridpts = uniform_grid_size(r_inn, r_out, Dr)
+    grid = np.empty((ngridpts,3), dtype=np.float64)
+    grid[0,0] = r_inn
+    grid[0,1] = r_inn + Dr/2
+    grid[0,2] = r_inn + Dr
+    grid[1:,:] = Dr
+    return np.cumsum(grid, axis=0)
+
+def uniform_grid_size(r_inn, r_out, Dr):
+    # Number of intervals of the uniform grid of spacing Dr covering [r_inn, r_out]
+    if not Dr > 0:
+        raise ValueError('uniform grid needs a spacing Dr > 0')
+    return int(math.floor((r_out - r_inn)/Dr)) + 1
+
+def uniform_grid_chunks(r_inn, r_out, Dr, chunk_size):
+    # Generate the uniform grid of uniform_grid(r_inn, r_out, Dr) in chunks
+    # of at most chunk_size intervals, without holding the whole grid.
+    # Yields (start, grid) where grid holds the intervals start, ..., start+len(grid)-1.
+    # The running sums continue across chunks, so the radii are identical to uniform_grid's.
+    ngridpts = uniform_grid_size(r_inn, r_out, Dr)
+    last = None
+    for start in range(0, ngridpts, chunk_size):
+        grid = np.empty((min(chunk_size, ngridpts-start),3), dtype=np.float64)
+        if last is None:
+            grid[0,0] = r_inn
+            grid[0,1] = r_inn + Dr/2
+            grid[0,2] = r_inn + Dr
+        else:
+            grid[0] = last + Dr
+        grid[1:,:] = Dr
+        grid = np.cumsum(grid, axis=0)
+        last = grid[-1]
+        yield start, grid
+
+def edges_grid(edges):
+    # Return the grid with interval edges edges (strictly increasing, one more
+    # than the number of intervals) as an array of shape (intervals, 3) of
+    # inner, center and outer radii, the centers midway between the edges
+    # as on the uniform grid.
+    edges = np.asarray(edges, dtype=np.float64)
+    if edges.ndim != 1 or len(edges) < 2 or np.any(np.diff(edges) <= 0):
+        raise ValueError('grid edges must be a strictly increasing array of at least 2 radii')
+    grid = np.empty((len(edges)-1,3), dtype=np.float64)
+    grid[:,0] = edges[:-1]
+    grid[:,2] = edges[1:]
+    grid[:,1] = 0.5*(edges[:-1] + edges[1:])
+    return grid
+
+def log_edges(r_inn, r_out, n, r_min):
+    # Edges of a grid of n+1 intervals: [r_inn, r_min], then n intervals
+    # evenly spaced in log radius from r_min to r_out.
+    if not r_inn < r_min < r_out:
+        raise ValueError('log grid needs r_inn < r_min < r_out')
+    if n < 1:
+        raise ValueError('log grid needs at least 1 log-spaced interval')
+    return np.concatenate([[r_inn], np.logspace(math.log10(r_min), math.log10(r_out), n+1)])
+
+def stretched_edges(r_inn, r_out, Dr, ratio, Dr_max=None):
+    # Edges of a grid starting at r_inn with an interval of Dr, each interval
+    # ratio times wider than the one before (up to Dr_max if given), and
+    # ending with the first edge at or beyond r_out.
+    if not ratio >= 1.0:
+        raise ValueError('stretched grid needs ratio >= 1')
+    if not Dr > 0 or (Dr_max is not None and not Dr_max > 0):
+        raise ValueError('stretched grid needs Dr > 0 and Dr_max > 0')
+    dr = []
+    total = 0.0
+    d = Dr
+    while total < r_out - r_inn:
+        dr.append(d)
+        total += d
+        d = d*ratio if Dr_max is None else min(d*ratio, Dr_max)
+    return r_inn + np.concatenate([[0.0], np.cumsum(dr)])
+
+def mass_edges(rcminner, radiuscm, density, n):
+    # Edges of a grid of n intervals each enclosing the same mass of the star,
+    # found by inverting the enclosed mass within each (constant density) zone.
+    if n < 1:
+        raise ValueError('mass grid needs at least 1 interval')
+    kMass = density*(radiuscm**2 + radiuscm*rcminner + rcminner**2)*(radiuscm-rcminner)
+    mcum = np.zeros(len(kMass)+1)
+    mcum[1:] = np.cumsum(kMass)
+    target = mcum[-1]*np.arange(n+1)/float(n)
+    j = np.clip(np.searchsorted(mcum, target, 'right')-1, 0, len(kMass)-1)
+    edges = np.cbrt(rcminner[j]**3 + (target - mcum[j])/density[j])
+    edges[0] = rcminner[0]
+    edges[-1] = radiuscm[-1]
+    return edges
+
+def decompose(rcminner, radiuscm, grid, nparts):
+    # Split the grid intervals into nparts contiguous blocks of roughly equal
+    # estimated cost (see cell_costs and balance_ranges), and find the MESA
+    # zones each block needs (see zone_window).
+    # Returns (counts, starts, zone_start, zone_end, costs) as lists, one entry per block.
+    cost = cell_costs(rcminner, radiuscm, grid[:,0], grid[:,2])
+    counts, starts = balance_ranges(cost, nparts)
+    costs = [float(np.sum(cost[starts[i]:starts[i]+counts[i]])) for i in range(nparts)]
+    zone_start = []
+    zone_end = []
+    for i in range(nparts):
+        if counts[i] == 0:
+            zone_start.append(0)
+            zone_end.append(0)
+            continue
+        jlo, jhi = zone_window(rcminner, radiuscm, grid[starts[i],0], grid[starts[i]+counts[i]-1,2])
+        zone_start.append(jlo)
+        zone_end.append(jhi)
+    return counts, starts, zone_start, zone_end, costs
+
+def remap_block(star, grid, vars, varx, poly_n, start=0, zone_start=0, npts=None, out=None,
+                integrals=None):
+    # Remap a contiguous block of grid intervals: find the overlaps, mass-average
+    # the intervals containing MESA zones, interpolate the empty ones and
+    # renormalize the abundances.
+    # star: dictionary of the MESA zone arrays 'rcminner', 'radiuscm', 'rad_cm_ctr'
+    #       and each of vars, for the zones zone_start, ... (see zone_window)
+    # grid: array of shape (intervals, 3) of interval inner, center and outer radii
+    # vars: names of the variables to remap, which must include 'density'
+    # varx: names among vars of the abundances to renormalize
+    # start, zone_start, npts: index of the first interval in the whole grid,
+    #                          of the first zone in the star, and the number of star zones
+    # out: optional array of shape (intervals, len(vars)) to fill
+    # integrals: zone_integrals of the star zones for the variables other than
+    #            'density' in the order of vars, if already computed
+    # Returns out, holding the remapped variables in the order of vars.
+    vars = list(vars)
+    if npts is None:
+        npts = len(star['radiuscm'])
+    if out is None:
+        out = np.zeros((len(grid), len(vars)), dtype=np.float64)
+    cont_lo, cont_hi, empty, empty_zones = find_overlaps(star['rcminner'], star['radiuscm'],
+                                                         grid[:,0], grid[:,2])
+
+    # Mass-averaged quantities for the intervals containing MESA zones
+    mass_vars = [v for v in vars if v != 'density']
+    mass_values = np.column_stack([star[v] for v in mass_vars])
+    rho_avg, mass_avg = mass_average(star['rcminner'], star['radiuscm'], star['density'], mass_values,
+                                     grid[:,0], grid[:,2], cont_lo, cont_hi, start=start,
+                                     integrals=integrals)
+    full = cont_hi > cont_lo
+    for n, v in enumerate(mass_vars):
+        out[full,vars.index(v)] = mass_avg[full,n]
+    out[full,vars.index('density')] = rho_avg[full]
+
+    # Interpolated quantities for the empty intervals
+    all_values = np.column_stack([star[v] for v in vars])
+    out[empty] = interpolate_empty(star['rad_cm_ctr'], all_values, grid[empty,1], empty_zones,
+                                   poly_n, zone_start=zone_start, npts=npts)
+
+    ## Now renormalize all abundances (in case mass-averaging and quadratic interpolation broke normalization)
+    ix = [vars.index(x) for x in varx]
+    if ix and ix == list(range(ix[0], ix[0]+len(ix))):
+        renormalize(out[:,ix[0]:ix[0]+len(ix)], out=out[:,ix[0]:ix[0]+len(ix)])
+    elif ix:
+        out[:,ix] = renormalize(out[:,ix])
+    return out
+
+def format_rows(block, sep=' ', trailing=True):
+    # Format the rows of the 2D array block as text in one operation, each
+    # value in '%.15e' format, values separated by sep (also after the last
+    # value of a row if trailing), one row per line.
+    nrows, ncols = block.shape
+    line = sep.join(['%.15e']*ncols) + (sep if trailing else '') + '\n'
+    return (line*nrows) % tuple(block.ravel().tolist())
+
+def write_rows(f, block, sep=' ', trailing=True, chunk_rows=10000):
+    # Write the rows of the 2D array block to the open file f as format_rows
+    # does, chunk_rows rows at a time to bound the size of the formatted text
+    for a in range(0, len(block), chunk_rows):
+        f.write(format_rows(block[a:a+chunk_rows], sep, trailing))
+
+def write_grid_header(f, vars, ngridpts):
+    # Write the header line and the number of grid points of a grid file to
+    # the open file f
+    modelHeader = '#  ' + 'radius  '
+    for vark in vars:
+        modelHeader = modelHeader + vark + '  '
+    f.write(modelHeader + '\n')
+    f.write(str(ngridpts)+'\n')
+
+def write_grid_rows(f, ctr, values):
+    # Write the rows of a grid file to the open file f: each interval center
+    # in ctr followed by its row of values, all in '%.15e ' format
+    write_rows(f, np.column_stack([ctr, values]))
+
+class GridFileWriter(object):
+    def __init__(self, gridFileName, vars, ngridpts, format='text'):
+        ## Open the grid file gridFileName for ngridpts rows of the interval
+        ## center followed by vars, written in one or more calls to write.
+        ## format: 'text' writes the usual grid file: a header line, the number
+        ##         of grid points, then one row per line in '%.15e ' format.
+        ##         'raw' writes the rows as little-endian float64, row-major,
+        ##         and 'npy' as a numpy .npy array of shape (ngridpts, len(vars)+1).
+        ##         Both binary formats write the text header lines to the
+        ##         sidecar file gridFileName + '.header'.
+        if format not in ('text', 'raw', 'npy'):
+            raise ValueError('unknown grid file format ' + str(format))
+        self.format = format
+        self.gridFileName = gridFileName
+        self.ngridpts = ngridpts
+        self.ncols = len(vars) + 1
+        self.nrows = 0
+        if format == 'text':
+            self.f = open(gridFileName, 'w')
+            write_grid_header(self.f, vars, ngridpts)
+            return
+        fh = open(gridFileName + '.header', 'w')
+        write_grid_header(fh, vars, ngridpts)
+        fh.close()
+        self.f = open(gridFileName, 'wb')
+        if format == 'npy':
+            np.lib.format.write_array_header_1_0(self.f, {'descr': '<f8', 'fortran_order': False,
+                                                          'shape': (ngridpts, self.ncols)})
+
+    def write(self, ctr, values):
+        ## Append the rows of interval centers ctr and values, an array of shape (len(ctr), len(vars))
+        if self.format == 'text':
+            write_grid_rows(self.f, ctr, values)
+        else:
+            self.f.write(np.column_stack([ctr, values]).astype('<f8').tobytes())
+        self.nrows += len(ctr)
+
+    def close(self):
+        ## Close the grid file, whatever the number of rows written
+        self.f.close()
+
+    def finish(self):
+        ## Close the grid file once all rows are written. If it did not
+        ## receive exactly ngridpts rows its header is wrong, so it is removed.
+        self.close()
+        if self.nrows != self.ngridpts:
+            self.discard()
+            raise ValueError('wrote ' + str(self.nrows) + ' rows to a grid file of ' + str(self.ngridpts))
+
+    def discard(self):
+        ## Close and remove the grid file and any header sidecar, e.g. after
+        ## a failure left it incomplete
+        self.close()
+        names = [self.gridFileName]
+        if self.format != 'text':
+            names.append(self.gridFileName + '.header')
+        for name in names:
+            if os.path.exists(name):
+                os.remove(name)
+
+def remap_shared(args):
+    # Remap one block of grid intervals for remap_pool, reading the star and
+    # grid from and writing the result to shared memory. Returns the time
+    # spent remapping.
+    from multiprocessing import shared_memory
+    (star_name, star_shape, star_fields, grid_name, grid_shape, out_name,
+     vars, varx, poly_n, start, count, zone_start, zone_end) = args
+    blocks = [shared_memory.SharedMemory(name=n) for n in (star_name, grid_name, out_name)]
+    try:
+        star_buf = np.ndarray(star_shape, dtype=np.float64, buffer=blocks[0].buf)
+        grid_buf = np.ndarray(grid_shape, dtype=np.float64, buffer=blocks[1].buf)
+        out_buf = np.ndarray((grid_shape[0], len(vars)), dtype=np.float64, buffer=blocks[2].buf)
+        time_start = time.time()
+        star = dict([(k, star_buf[zone_start:zone_end,n]) for n, k in enumerate(star_fields)])
+        remap_block(star, grid_buf[start:start+count], vars, varx, poly_n, start=start,
+                    zone_start=zone_start, npts=star_shape[0], out=out_buf[start:start+count])
+        elapsed = time.time() - time_start
+        del star, star_buf, grid_buf, out_buf
+    finally:
+        for b in blocks:
+            b.close()
+    return elapsed
+
+def remap_pool(star_buf, star_fields, grid_buf, vars, varx, poly_n,
+               counts, starts, zone_start, zone_end, processes=None):
+    # Remap the grid in blocks with a local process pool instead of MPI.
+    # star_buf: array of shape (zones, fields) of the whole star, columns named by star_fields
+    # grid_buf: array of shape (intervals, 3), as for remap_block
+    # counts, starts: block i holds the intervals starts[i] <= j < starts[i]+counts[i]
+    # zone_start, zone_end: block i needs the zones zone_start[i] <= k < zone_end[i]
+    # processes: size of the process pool, default one per block. With a
+    #            single process the blocks are remapped in this process.
+    # The star, grid and result live in shared memory, which the workers
+    # attach to instead of receiving copies.
+    # Returns (out, times): the remapped variables of shape (intervals, len(vars))
+    # and the time spent on each block.
+    vars = list(vars)
+    out_buf = np.zeros((len(grid_buf), len(vars)), dtype=np.float64)
+    if processes == 1:
+        times = []
+        for i in range(len(counts)):
+            time_start = time.time()
+            star = dict([(k, star_buf[zone_start[i]:zone_end[i],n]) for n, k in enumerate(star_fields)])
+            remap_block(star, grid_buf[starts[i]:starts[i]+counts[i]], vars, varx, poly_n,
+                        start=starts[i], zone_start=zone_start[i], npts=len(star_buf),
+                        out=out_buf[starts[i]:starts[i]+counts[i]])
+            times.append(time.time() - time_start)
+        return out_buf, times
+
+    from multiprocessing import shared_memory
+    blocks = []
+    try:
+        views = []
+        for a in (star_buf, grid_buf, out_buf):
+            b = shared_memory.SharedMemory(create=True, size=max(a.nbytes, 1))
+            blocks.append(b)
+            v = np.ndarray(a.shape, dtype=np.float64, buffer=b.buf)
+            v[...] = a
+            views.append(v)
+        jobs = [(blocks[0].name, star_buf.shape, list(star_fields), blocks[1].name, grid_buf.shape,
+                 blocks[2].name, vars, list(varx), poly_n, starts[i], counts[i], zone_start[i], zone_end[i])
+                for i in range(len(counts))]
+        pool = Pool(processes if processes else len(jobs))
+        try:
+            times = pool.map(remap_shared, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+        out_buf[...] = views[2]
+        del views, v
+    finally:
+        for b in blocks:
+            b.close()
+            b.unlink()
+    return out_buf, times
+
+class MesaRemapper(object):
+    def __init__(self, star, poly_n=2, vars=None, varx=None, processes=1):
+        ## star: a MesaProfile, or its star data structure
+        ## poly_n: interpolation order, 1 = linear, 2 = quadratic, 3 = cubic
+        ## vars: names of the variables to remap, default density, temperature,
+        ##       ye and the isotopes of the MesaProfile
+        ## varx: names among vars of the abundances to renormalize, default the isotopes
+        ## processes: number of processes to remap with (see remap_pool)
+        isotopes = []
+        if hasattr(star, 'star'):
+            isotopes = list(star.isotopes.keys())
+            star = star.star
+        if vars is None:
+            vars = ['density', 'temperature', 'ye'] + isotopes
+        if varx is None:
+            varx = [v for v in isotopes if v in vars]
+        self.star = star_geometry(star)
+        self.vars = list(vars)
+        self.varx = list(varx)
+        self.poly_n = poly_n
+        self.processes = processes
+
+        ## The star as one (zones, fields) block, and the zone integrals,
+        ## which every grid resolution shares
+        self.star_fields = ['rcminner', 'radiuscm', 'rad_cm_ctr'] + self.vars
+        self.star_buf = np.column_stack([self.star[k] for k in self.star_fields])
+        self.star_view = OrderedDict([(k, self.star_buf[:,n]) for n, k in enumerate(self.star_fields)])
+        mass_values = np.column_stack([self.star[v] for v in self.vars if v != 'density'])
+        self.integrals = zone_integrals(self.star['rcminner'], self.star['radiuscm'],
+                                        self.star['density'], mass_values)
+
+    def uniformGrid(self, Dr):
+        ## Return the uniform grid of spacing Dr covering the star (see uniform_grid)
+        return uniform_grid(self.star['rcminner'][0], self.star['radiuscm'][-1], Dr)
+
+    def remapGrid(self, grid, out=None):
+        ## Remap the star onto grid, an array of shape (intervals, 3) of
+        ## interval inner, center and outer radii. Returns a dictionary of
+        ## arrays with 'rad_cm_inn', 'rad_cm_ctr', 'rad_cm_out' and each of vars.
+        ## out: optional array of shape (intervals, len(vars)) to hold the
+        ##      remapped variables, when remapping in this process
+        if self.processes == 1:
+            out = remap_block(self.star_view, grid, self.vars, self.varx, self.poly_n,
+                              out=out, integrals=self.integrals)
+        else:
+            nparts = self.processes if self.processes else cpu_count()
+            counts, starts, zone_start, zone_end, costs = decompose(self.star['rcminner'], self.star['radiuscm'],
+                                                                    grid, nparts)
+            out, times = remap_pool(self.star_buf, self.star_fields, grid, self.vars, self.varx, self.poly_n,
+                                    counts, starts, zone_start, zone_end, processes=nparts)
+        ugrid = OrderedDict([])
+        ugrid['rad_cm_inn'] = grid[:,0]
+        ugrid['rad_cm_ctr'] = grid[:,1]
+        ugrid['rad_cm_out'] = grid[:,2]
+        for n, k in enumerate(self.vars):
+            ugrid[k] = out[:,n]
+        return ugrid
+
+    def remapStream(self, Dr, gridFileName, chunk_size=100000, format='text', edges=None):
+        ## Remap the star onto the uniform grid of spacing Dr and write it to
+        ## the grid file gridFileName, chunk_size intervals at a time. Each
+        ## chunk is remapped with only the MESA zones it overlaps plus the
+        ## interpolation stencil halo, and its rows are appended to the file
+        ## before the next chunk is made, so memory is bounded by chunk_size
+        ## rather than by the size of the grid. The file is identical to the
+        ## one written for the whole grid at once.
+        ## format: grid file format (see GridFileWriter)
+        ## edges: if given, stream the grid with these interval edges instead
+        ##        (see edges_grid), ignoring Dr
+        ## Returns the number of grid intervals written.
+        r_inn = self.star['rcminner'][0]
+        r_out = self.star['radiuscm'][-1]
+        if edges is None:
+            ngridpts = uniform_grid_size(r_inn, r_out, Dr)
+            chunks = uniform_grid_chunks(r_inn, r_out, Dr, chunk_size)
+        else:
+            ngridpts = len(edges)-1
+            chunks = ((start, edges_grid(edges[start:start+chunk_size+1]))
+                      for start in range(0, ngridpts, chunk_size))
+        npts = len(self.star_buf)
+        kVol, kMass, kData = self.integrals
+        gridFile = GridFileWriter(gridFileName, self.vars, ngridpts, format)
+        try:
+            for start, grid in chunks:
+                jlo, jhi = zone_window(self.star['rcminner'], self.star['radiuscm'], grid[0,0], grid[-1,2])
+                star = OrderedDict([(k, v[jlo:jhi]) for k, v in self.star_view.items()])
+                out = remap_block(star, grid, self.vars, self.varx, self.poly_n, start=start,
+                                  zone_start=jlo, npts=npts,
+                                  integrals=(kVol[jlo:jhi], kMass[jlo:jhi], kData[jlo:jhi]))
+                gridFile.write(grid[:,1], out)
+        except BaseException:
+            # Do not leave a partial file behind a header claiming all ngridpts rows
+            gridFile.discard()
+            raise
+        gridFile.finish()
+        return ngridpts
+
+    def remapEdges(self, edges):
+        ## Remap the star onto the grid with interval edges edges, any strictly
+        ## increasing array of radii (see edges_grid, log_edges, stretched_edges,
+        ## massEdges). If edges is a list of arrays, return a list with one grid per array.
+        if np.ndim(edges[0]) == 0:
+            return self.remapGrid(edges_grid(edges))
+        return [self.remapGrid(edges_grid(e)) for e in edges]
+
+    def massEdges(self, n):
+        ## Return the edges of a grid of n intervals of equal mass covering the star (see mass_edges)
+        return mass_edges(self.star['rcminner'], self.star['radiuscm'], self.star['density'], n)
+
+    def remap(self, Dr):
+        ## Remap the star onto the uniform grid of spacing Dr (see remapGrid).
+        ## If Dr is a list of spacings, return a list with one grid per spacing.
+        if np.ndim(Dr) == 0:
+            return self.remapGrid(self.uniformGrid(Dr))
+        return [self.remapGrid(self.uniformGrid(d)) for d in Dr]
+
+class GridWorkspace(object):
+    def __init__(self, Dr=None, edges=None):
+        ## Grid geometry and output buffers shared by the remaps of many
+        ## profiles onto one grid definition: the uniform grid of spacing Dr,
+        ## or the grid with interval edges edges (see edges_grid).
+        ## Buffers grow as needed and are reused, never reallocated per profile.
+        self.Dr = Dr
+        self.grid_buf = None if edges is None else edges_grid(edges)
+        self.fixed = edges is not None
+        self.out_buf = np.empty(0, dtype=np.float64)
+
+    def grid(self, r_inn, r_out):
+        ## Return the grid covering the star [r_inn, r_out]. A uniform grid is a
+        ## view of the first intervals of one kept grid starting at r_inn, whose
+        ## running sums are the same as those of a grid made for this star alone.
+        if self.fixed:
+            return self.grid_buf
+        n = uniform_grid_size(r_inn, r_out, self.Dr)
+        if self.grid_buf is None or self.grid_buf[0,0] != r_inn or len(self.grid_buf) < n:
+            size = n if self.grid_buf is None else max(n, 2*len(self.grid_buf))
+            self.grid_buf = uniform_grid(r_inn, r_inn + (size-1)*self.Dr, self.Dr)
+            if len(self.grid_buf) < n:
+                self.grid_buf = uniform_grid(r_inn, r_out, self.Dr)
+        return self.grid_buf[:n]
+
+    def out(self, n, nvars):
+        ## Return an array of shape (n, nvars) for the remapped variables,
+        ## a view into the kept output buffer
+        if len(self.out_buf) < n*nvars:
+            self.out_buf = np.empty(max(n*nvars, 2*len(self.out_buf)), dtype=np.float64)
+        return self.out_buf[:n*nvars].reshape(n, nvars)
+
+## The workspace of this process for remap_profile_file (see init_batch_workspace)
+batch_workspace = None
+
+def init_batch_workspace(Dr, edges):
+    ## Give this process the GridWorkspace used by remap_profile_file
+    global batch_workspace
+    batch_workspace = GridWorkspace(Dr, edges)
+
+def remap_profile_file(args):
+    # Read the profile pname, remap it onto the grid of the batch workspace
+    # (see init_batch_workspace) and write the grid file output, as
+    # UniformMesaGrid.py would.
+    # map_flash: map the abundances to the FLASH C12, O16, Ne20, Ne22 set
+    # Returns (pname, number of grid intervals written, None), or if the remap
+    # fails (e.g. on a singular fit) (pname, 0, error message), so that one
+    # bad profile does not stop the rest of a batch.
+    pname, output, poly_n, map_flash, format = args
+    try:
+        return pname, remap_profile(pname, output, poly_n, map_flash, format), None
+    except (ValueError, np.linalg.LinAlgError) as e:
+        return pname, 0, str(e)
+
+def remap_profile(pname, output, poly_n, map_flash, format):
+    # Remap one profile for remap_profile_file, returning the number of grid intervals
+    mesa = MesaProfile(pname)
+    star = mesa.star
+    if map_flash:
+        fcomp = MapMesaComposition().getmap(star)
+        for k in fcomp.keys():
+            star[k] = fcomp[k]
+        vars = ['density', 'temperature'] + list(fcomp.keys())
+        varx = list(fcomp.keys())
+    else:
+        vars = ['density', 'temperature', 'ye'] + list(mesa.isotopes.keys())
+        varx = list(mesa.isotopes.keys())
+    remapper = MesaRemapper(star, poly_n=poly_n, vars=vars, varx=varx)
+    grid = batch_workspace.grid(remapper.star['rcminner'][0], remapper.star['radiuscm'][-1])
+    out = batch_workspace.out(len(grid), len(vars))
+    remapper.remapGrid(grid, out=out)
+    gridFile = GridFileWriter(output, vars, len(grid), format)
+    try:
+        gridFile.write(grid[:,1], out)
+    except BaseException:
+        gridFile.discard()
+        raise
+    gridFile.finish()
+    return len(grid)
+
+def remap_profiles(pnames, outputs, poly_n, Dr=None, edges=None, map_flash=False,
+                   format='text', processes=None, comm=None):
+    # Remap each profile in pnames onto one grid definition, the uniform grid
+    # of spacing Dr or the grid with interval edges edges, and write each
+    # to the grid file of the same index in outputs (see remap_profile_file).
+    # Whole profiles are distributed between the ranks of the MPI
+    # communicator comm, or if comm is None between the workers of a process
+    # pool of size processes (default one per core; 1 remaps in this process).
+    # Each process keeps one GridWorkspace for all its profiles.
+    # Returns the list of remap_profile_file results for the profiles of this process.
+    jobs = [(p, o, poly_n, map_flash, format) for p, o in zip(pnames, outputs)]
+    if comm is not None:
+        init_batch_workspace(Dr, edges)
+        return [remap_profile_file(j) for j in jobs[comm.Get_rank()::comm.Get_size()]]
+    if processes == 1 or len(jobs) < 2:
+        init_batch_workspace(Dr, edges)
+        return [remap_profile_file(j) for j in jobs]
+    pool = Pool(processes, initializer=init_batch_workspace, initargs=(Dr, edges))
+    try:
+        results = pool.map(remap_profile_file, jobs, chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+    return results
@@ -0,0 +1,108 @@
+"""
+This class loads a sequence of MESA profiles in parallel into stacked arrays.
+
+The profiles are parsed in a process pool and consolidated into one
+concatenated numpy array per field, with an offsets table giving the
+zones belonging to each profile. Only the fields present in every
+profile are kept, so all profiles share the same set of columns.
+
+Usage:
+    seq = MesaSequence('LOGS/profile*.data', columns=['radius', 'logRho'])
+    for i in range(len(seq.paths)):
+        rho = seq.star['logRho'][seq.offsets[i]:seq.offsets[i+1]]
+    age = seq.head['star_age'][i]
+
+Copyright 2015 Donald E. Willcox
+
+This file is part of mesa2flash.
+
+    mesa2flash is free software: you can redistribute it and/or modify
+    it under the terms of the GNU General Public License as published by
+    the Free Software Foundation, either version 3 of the License, or
+    (at your option) any later version.
+
+    mesa2flash is distributed in the hope that it will be useful,
+    but WITHOUT ANY WARRANTY; without even the implied warranty of
+    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+    GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import glob
+import numpy as np
+from multiprocessing import Pool
+from collections import OrderedDict
+from MesaProfile import MesaProfile, MesaStar
+
+def readProfileBlock(args):
+    ## Parse the given columns of a profile and return its header,
+    ## data block and integer flags
+    pname, columns = args
+    mesa = MesaProfile(pname, columns=columns)
+    return mesa.head, mesa.data, mesa.data_is_int
+
+class MesaSequence(object):
+    def __init__(self, profiles=None, columns=None, processes=None):
+        ## paths: profile file names in the order they are stacked
+        self.paths = []
+        ## offsets: zones of profile i are [offsets[i], offsets[i+1]) in each star array
+        self.offsets = np.zeros(1, dtype=np.int64)
+        ## head: dictionary of arrays with each shared numeric header field per profile
+        self.head = OrderedDict([])
+        ## star: dictionary of concatenated arrays, one per field
+        self.star = OrderedDict([])
+        if profiles:
+            self.load(profiles, columns, processes)
+
+    def load(self, profiles, columns=None, processes=None):
+        ## profiles: list of profile file names, or a glob pattern in which
+        ##           case the profiles are ordered by model_number.
+        ## columns: fields to read, default all fields shared by every profile.
+        ## processes: size of the process pool, default one per core.
+        if isinstance(profiles, str):
+            profiles = glob.glob(profiles)
+            heads = [MesaProfile(p, header_only=True).head for p in profiles]
+            if all(['model_number' in h for h in heads]):
+                profiles = [p for (m, p) in sorted(zip([h['model_number'] for h in heads], profiles))]
+        self.paths = list(profiles)
+        if columns is None:
+            fields = [MesaProfile(p, header_only=True).zone_fields for p in self.paths]
+            columns = [f for f in fields[0] if all([f in fi for fi in fields[1:]])] if fields else []
+
+        jobs = [(p, columns) for p in self.paths]
+        if processes == 1 or len(jobs) < 2:
+            results = [readProfileBlock(j) for j in jobs]
+        else:
+            pool = Pool(processes)
+            try:
+                results = pool.map(readProfileBlock, jobs)
+            finally:
+                pool.close()
+                pool.join()
+
+        nzones = [r[1].shape[1] for r in results]
+        self.offsets = np.zeros(len(results)+1, dtype=np.int64)
+        self.offsets[1:] = np.cumsum(nzones)
+
+        self.head = OrderedDict([])
+        if results:
+            for k, v in results[0][0].items():
+                if not isinstance(v, str) and all([k in r[0] for r in results]):
+                    self.head[k] = np.array([r[0][k] for r in results])
+
+        self.star = OrderedDict([])
+        for i, f in enumerate(columns):
+            is_int = all([r[2][i] for r in results])
+            self.star[f] = np.empty(self.offsets[-1], dtype=np.int64 if is_int else np.float64)
+            for j, r in enumerate(results):
+                self.star[f][self.offsets[j]:self.offsets[j+1]] = r[1][i]
+        return self.star
+
+    def getProfile(self, i):
+        ## Return the star data structure of profile i as views into the stacked arrays
+        ## (a MesaStar, so derived fields such as radiuscm are available)
+        s = MesaStar()
+        for k in self.star.keys():
+            s[k] = self.star[k][self.offsets[i]:self.offsets[i+1]]
+        return s
@@ -4,8 +4,11 @@ averaging regions of the MESA profile where the grid is denser than the
 uniform grid and interpolating in regions where the MESA grid is more widely
 spaced than the uniform grid.
 
+The target grid may instead be log-spaced or stretched in radius, uniform
+in enclosed mass (-g), or given as a file of interval edges (-e).
+
 Parameters controlling the program...
-Dr: uniform grid spacing
+Dr: uniform grid spacing (or innermost spacing of a stretched grid)
 cubic, quad, linear: only one of these can be True, they set interpolation type.
 gridFileName: name of the uniform grid profile to write out
 mesaInProfileName: name of the MESA profile to read
@@ -31,13 +34,14 @@ This file is part of mesa2flash.
     along with mesa2flash.  If not, see <http://www.gnu.org/licenses/>.
 """
 from __future__ import print_function
-from mpi4py import MPI
+import sys
 import numpy as np
-import math
 import argparse
 from collections import OrderedDict
 from MesaProfile import MesaProfile
 from MapMesaComposition import MapMesaComposition
+from MesaRemap import star_geometry, uniform_grid, edges_grid, log_edges, stretched_edges, mass_edges
+from MesaRemap import decompose, remap_block, remap_pool, MesaRemapper, GridFileWriter
 
 parser = argparse.ArgumentParser()
 parser.add_argument('MESA_INPUT_FILE', type=str, help='Name of the input MESA profile.')
@@ -45,24 +49,75 @@ parser.add_argument('-o', '--output', type=str, help='Name of the output file to
 parser.add_argument('-drcm', '--delta_radius_cm', type=float, help='Step size to use in radius in units of cm.')
 parser.add_argument('-ip', '--interpolation', type=int, help='Interpolation type to use. 1 = Linear, 2 = Quadratic, 3 = Cubic. Cubic can suffer from continuity issues, so be careful. I recommend quadratic. This will not enforce HSE, you need, e.g. WDBuilder to post-process the output this program creates in order to obtain HSE.')
 parser.add_argument('-mfx', '--map_abundances_flash', action='store_true', help='Map the MESA abundances to FLASH reduced composition: C12, O16, Ne20, Ne22.')
+parser.add_argument('-b', '--backend', type=str, choices=['mpi', 'pool'], help='Parallel backend: mpi (run under mpiexec) or pool (a local process pool, no MPI needed). Default is mpi if mpi4py is installed, otherwise pool.')
+parser.add_argument('-np', '--processes', type=int, help='Number of processes for the pool backend. Default is one per core; 1 runs serially without a pool.')
+parser.add_argument('-c', '--chunk_size', type=int, help='Stream the remap: walk the grid in chunks of this many intervals, appending each to the output file, so memory use is bounded by the chunk size instead of the grid size. Runs in a single process.')
+parser.add_argument('-f', '--format', type=str, choices=['text', 'raw', 'npy'], default='text', help='Output format: text (the default), or binary float64 rows, raw little-endian or .npy. The binary formats write the text header to OUTPUT.header.')
+parser.add_argument('-g', '--grid', type=str, choices=['uniform', 'log', 'stretched', 'mass'], default='uniform', help='Target grid: uniform in radius with spacing DELTA_RADIUS_CM (the default), log-spaced in radius (see --npoints, --rmin), stretched from an innermost spacing DELTA_RADIUS_CM (see --stretch, --drmax), or uniform in enclosed mass (see --npoints).')
+parser.add_argument('-n', '--npoints', type=int, help='Number of intervals of a mass grid, or of log-spaced intervals of a log grid, which has one more interval from the center to RMIN.')
+parser.add_argument('--rmin', type=float, help='Radius in cm of the inner edge of the first log-spaced interval of a log grid; the grid starts with one interval from the center to RMIN.')
+parser.add_argument('--stretch', type=float, default=1.01, help='Ratio of the widths of neighboring intervals of a stretched grid. Default is 1.01.')
+parser.add_argument('--drmax', type=float, help='Largest interval width in cm of a stretched grid.')
+parser.add_argument('-e', '--edges', type=str, help='Text file of increasing interval edge radii in cm to remap onto, instead of a --grid.')
 args = parser.parse_args()
 
-# Global MPI information
-mpi_comm = MPI.COMM_WORLD
-mpi_size = mpi_comm.Get_size()
-mpi_rank = mpi_comm.Get_rank()
-
-cmperRsun = 6.955e10
+if args.delta_radius_cm is not None and not args.delta_radius_cm > 0:
+    parser.error('-drcm must be positive')
+if args.drmax is not None and not args.drmax > 0:
+    parser.error('--drmax must be positive')
+if not args.stretch >= 1:
+    parser.error('--stretch must be at least 1')
+
+# Each grid type needs its own options, unless the edges are given directly
+if not args.edges:
+    if args.grid in ('uniform', 'stretched') and args.delta_radius_cm is None:
+        parser.error('-g ' + args.grid + ' requires -drcm')
+    if args.grid in ('log', 'mass') and (args.npoints is None or args.npoints < 1):
+        parser.error('-g ' + args.grid + ' requires -n with at least 1 interval')
+    if args.grid == 'log' and args.rmin is None:
+        parser.error('-g log requires --rmin')
+
+if args.backend is None:
+    # Use MPI where it is available, so plain runs also work without mpi4py
+    try:
+        import mpi4py
+        args.backend = 'mpi'
+    except ImportError:
+        args.backend = 'pool'
+
+if args.backend == 'mpi':
+    # Global MPI information
+    from mpi4py import MPI
+    mpi_comm = MPI.COMM_WORLD
+    mpi_size = mpi_comm.Get_size()
+    mpi_rank = mpi_comm.Get_rank()
+    wtime = MPI.Wtime
+else:
+    # The pool backend runs in one process, splitting the grid between pool workers
+    import time
+    from multiprocessing import cpu_count
+    mpi_comm = None
+    mpi_size = args.processes if args.processes else cpu_count()
+    mpi_rank = 0
+    wtime = time.time
+
+if args.chunk_size and mpi_comm is not None and mpi_size > 1:
+    if mpi_rank == 0:
+        print('ERROR: streaming with -c runs in a single process, do not start it with mpiexec -np > 1.')
+    sys.exit()
 
-### Import MESA Profile & Broadcast to all Processes ###
-if (mpi_rank == 0):
-    mesa = MesaProfile()
-    mesaInProfileName = args.MESA_INPUT_FILE
-    mesa.setInProfileName(mesaInProfileName)
-    mesa.readProfile()
-    mstar = mesa.getStar()
+### Import MESA Profile on the root Process ###
+# Each process parses a slice of the MESA zones and the slices are gathered on root.
+mesa = MesaProfile()
+mesaInProfileName = args.MESA_INPUT_FILE
+mesa.setInProfileName(mesaInProfileName)
+if mpi_comm is not None:
+    mesa.readProfileParallel(comm=mpi_comm, root=0)
+elif mpi_size > 1:
+    mesa.readProfileParallel(processes=mpi_size)
 else:
-    mstar = None
+    mesa.readProfile()
+mstar = mesa.getStar()
 
 ######
 ### Specify Output Parameters ###
@@ -110,367 +165,142 @@ if (mpi_rank == 0):
         vars_list = [('density',0),('temperature',1),('ye',2)]
         start_varx = len(vars_list)
         varx_list = []
-        isotopes = mesa.getIsotopes()
-
-        for k in mstar.keys():
-            if k in isotopes:
-                varx_list.append((k,start_varx))
-                start_varx += 1
+        for k in mesa.isotopes.keys():
+            varx_list.append((k,start_varx))
+            start_varx += 1
         vars_list += varx_list
         varx = OrderedDict(varx_list)
         vars = OrderedDict(vars_list)
-        
+    
     ### Create useful data structures ###
     # Number of MESA zones
     npts = len(mstar['zone'])
-    
-    # Create a field for radius in cm instead of Rsun units
-    mstar['radiuscm'] = cmperRsun*mstar['radius']
-    # From looking at the MESA source and particularly star/defaults/profile_columns.list and star/public/star_data.inc Q&A section,
-    # it is apparent that 'radius' is the outer cell boundary at each zone and 'rmid' is the volume-centered radius of the cell.
-    # NOTE: here I assume that the MESA parameter R_center, the radius of the outer edge of the core, is 0
-    # R_center is the inner radius of the innermost MESA zone.
-    # Create a field for inner zone radii
-    mstar['rcminner'] = np.array([0.0 for i in range(npts)])
-    mstar['rcminner'][0] = 0.0
-    mstar['rcminner'][1:npts] = np.array([mstar['radiuscm'][i-1] for i in range(1,npts)])
-    mstar['rad_cm_ctr'] = (0.5*(mstar['radiuscm']**3 + mstar['rcminner']**3))**(1.0/3.0)    
-
-    mstar['density'] = 10.0**mstar['logRho']
-    
-    #mstar['volume'] is the volume per zone in cm^3.
-    #mstar['volume'] = ((4.0*np.pi/3.0)*(mstar['radiuscm']**2 + 2.0*mstar['radiuscm']*mstar['rcminner'] + mstar['rcminner']**2)*
-    #                                    (mstar['radiuscm']-mstar['rcminner']))
-    mstar['volume'] = ((4.0*np.pi/3.0)*(mstar['radiuscm']**2 + mstar['radiuscm']*mstar['rcminner'] + mstar['rcminner']**2)*
-                                        (mstar['radiuscm']-mstar['rcminner']))
-else:
-    npts = None
-    vars = None
-    varx = None
-
-# Pass data from root to processes
-npts = mpi_comm.bcast(npts,root=0)    
-vars = mpi_comm.bcast(vars,root=0)
-varx = mpi_comm.bcast(varx,root=0)
-mstar = mpi_comm.bcast(mstar,root=0)
-
-# make the uniform grid data structure
-ugrid = OrderedDict([])
-
-r_int_cont = [] # For index i, contains a list of indices in rad_m which
-		# fall into the interval corresponding to gridData[rad_indx,i].
-		# If the interval associated with gridData[rad_indx,i] is empty		
-                # then r_int_cont[i] will be an empty list.
-r_int_empty = [] # Is a list of indices i for which r_int_cont[i] is empty
-r_int_empty_zones = [] # For each entry in r_int_empty, record the mesa zone you're in
-######
-### Make a Uniform Grid, Figure Out MESA zone geometry and grid overlaps ###
 
-if(mpi_rank == 0):
-    # Find how big to make the uniform grid
-    ngridpts = (int(math.floor((mstar['radiuscm'][-1] - mstar['rcminner'][0])/Dr))+1)
-    
+    # The zone geometry radiuscm, rcminner (inner zone radii), rad_cm_ctr
+    # (volume-centered zone radii) and density is computed as it is used
+    # (see MesaRemap.star_geometry)
+    mstar = star_geometry(mstar)
+
+    ### Find the target grid interval edges, unless the grid is uniform ###
+    r_inn = mstar['rcminner'][0]
+    r_out = mstar['radiuscm'][-1]
+    if args.edges:
+        edges = np.loadtxt(args.edges, ndmin=1)
+    elif args.grid == 'log':
+        edges = log_edges(r_inn, r_out, args.npoints, args.rmin)
+    elif args.grid == 'stretched':
+        edges = stretched_edges(r_inn, r_out, Dr, args.stretch, args.drmax)
+    elif args.grid == 'mass':
+        edges = mass_edges(mstar['rcminner'], mstar['radiuscm'], mstar['density'], args.npoints)
+    else:
+        edges = None
+
+    if args.chunk_size:
+        # Stream the remap chunk by chunk into the grid file
+        print('last modeldata radius: ' + str(mstar['radiuscm'][-1]))
+        remapper = MesaRemapper(mstar, poly_n=poly_n, vars=list(vars.keys()), varx=list(varx.keys()))
+        ngridpts = remapper.remapStream(Dr, gridFileName, chunk_size=args.chunk_size, format=args.format,
+                                        edges=edges)
+        print('Wrote ' + str(ngridpts) + ' grid intervals in chunks of ' + str(args.chunk_size) + '.')
+        sys.exit()
+
+    ######
+    ### Make the Grid ###
     print('last modeldata radius: ' + str(mstar['radiuscm'][-1]))
-    ugrid_to_scatter = OrderedDict([]) 
-    # Construct the uniform grid radius points
-    ugrid_to_scatter['rad_cm_ctr'] = np.array([0.0 for i in range(ngridpts)])
-    ugrid_to_scatter['rad_cm_inn'] = np.array([0.0 for i in range(ngridpts)])
-    ugrid_to_scatter['rad_cm_out'] = np.array([0.0 for i in range(ngridpts)])
-    ugrid_to_scatter['rad_cm_inn'][0] = mstar['rcminner'][0]
-    ugrid_to_scatter['rad_cm_ctr'][0] = ugrid_to_scatter['rad_cm_inn'][0] + Dr/2
-    ugrid_to_scatter['rad_cm_out'][0] = ugrid_to_scatter['rad_cm_inn'][0] + Dr
-    for i in range(1,ngridpts):
-        ugrid_to_scatter['rad_cm_inn'][i] = ugrid_to_scatter['rad_cm_inn'][i-1] + Dr
-        ugrid_to_scatter['rad_cm_ctr'][i] = ugrid_to_scatter['rad_cm_ctr'][i-1] + Dr
-        ugrid_to_scatter['rad_cm_out'][i] = ugrid_to_scatter['rad_cm_out'][i-1] + Dr    
-    
-    print('last griddata radius: ' + str(ugrid_to_scatter['rad_cm_out'][-1]))
-    for k in vars.keys():
-        ugrid_to_scatter[k] = np.array([0.0 for i in range(ngridpts)])
-    
-    ugkeys = [k for k in ugrid_to_scatter.keys()]
-
-else:
-    ngridpts = None
-    ugkeys = None    
-
-ugkeys = mpi_comm.bcast(ugkeys,root=0)
-
-# Rearrange ugrid data to prepare for scatter
-if (mpi_rank == 0):
-    elements_rank = [int(math.floor(ngridpts/mpi_size)) for i in range(mpi_size)]
-    elements_rank[-1] = elements_rank[-1] + (ngridpts-sum(elements_rank))
-    start_rank = [sum(elements_rank[0:i]) for i in range(mpi_size)]
-    start_rank[0] = 0
+    # Construct the grid radius points (columns: rad_cm_inn, rad_cm_ctr, rad_cm_out),
+    # for a uniform grid each a running sum of Dr
+    if edges is None:
+        grid_buf = uniform_grid(r_inn, r_out, Dr)
+    else:
+        grid_buf = edges_grid(edges)
+    ngridpts = len(grid_buf)
+    print('last griddata radius: ' + str(grid_buf[-1,2]))
+
+    # Split the uniform grid between processes in ranges of equal estimated
+    # work rather than equal numbers of intervals: intervals in the dense
+    # core contain many zones, those in the envelope need interpolation.
+    # Each process only gets the MESA zones its part of the grid overlaps,
+    # plus the zones needed by the interpolation stencils.
+    elements_rank, start_rank, zone_start, zone_end, cost_rank = decompose(mstar['rcminner'], mstar['radiuscm'],
+                                                                           grid_buf, mpi_size)
+
+    star_fields = ['rcminner','radiuscm','rad_cm_ctr'] + list(vars.keys())
+    star_buf = np.column_stack([mstar[k] for k in star_fields])
+    meta = (vars, varx, star_fields, npts, ngridpts, elements_rank, start_rank, zone_start, zone_end, cost_rank)
+
+if mpi_comm is None:
+    # Remap the blocks in a process pool sharing the star, grid and result
+    print('Remapping ' + str(ngridpts) + ' grid intervals in ' + str(mpi_size) + ' blocks.')
+    ugrid_buf, time_rank = remap_pool(star_buf, star_fields, grid_buf, list(vars.keys()), list(varx.keys()),
+                                      poly_n, elements_rank, start_rank, zone_start, zone_end,
+                                      processes=mpi_size)
 else:
-    ugrid_to_scatter = None
-    elements_rank = None
-    ugrid = OrderedDict([])
-
-elements_rank = mpi_comm.bcast(elements_rank,root=0)
-
-for k in ugkeys:
-    ugrid[k] = np.empty(elements_rank[mpi_rank],dtype=np.float64)
-
-if (mpi_rank == 0):
-    for k in ugkeys:
-        ugrid[k] = [ugrid_to_scatter[k][start_rank[i]:start_rank[i]+elements_rank[i]] for i in range(mpi_size)]
-
-for k in ugkeys:
-    ugrid[k] = mpi_comm.scatter(ugrid[k],root=0)
-
-#!don: find out if the scatter worked properly, yes it seems to have worked
-print('Rank: ' + str(mpi_rank) + ' ugrid is... ' + str(ugrid) + ' length: ' + str(len(ugrid['rad_cm_inn'])))
-print('Rank: ' + str(mpi_rank) + ' elements_rank is... ' + str(elements_rank))
-
-ngridpts_rank = len(ugrid[ugkeys[0]])
-    
-# Find which model points fall into which uniform grid intervals & vice-versa
-print('Rank: ' + str(mpi_rank) + ' starting to find overlaps.')
-for i in range(0,ngridpts_rank):
-    rint_cont = []	
-    j_contains = []
-    for j in range(0,npts):
-        if((mstar['rcminner'][j] >= ugrid['rad_cm_inn'][i]) and 
-            (mstar['radiuscm'][j] <= ugrid['rad_cm_out'][i])):
-                rint_cont.append(j)
-        if((mstar['rcminner'][j] < ugrid['rad_cm_inn'][i] and mstar['radiuscm'][j] > ugrid['rad_cm_inn'][i])
-            or (mstar['radiuscm'][j] > ugrid['rad_cm_out'][i] and mstar['rcminner'][j] < ugrid['rad_cm_out'][i])):
-            j_contains.append(j) 
-    r_int_cont.append(rint_cont)
-    if len(rint_cont) == 0:
-        r_int_empty.append(i)
-        r_int_empty_zones.append(j_contains)
-print('Rank: ' + str(mpi_rank) + ' completed finding overlaps.')
-
-######
-
-print('Rank: ' + str(mpi_rank) + ' beginning mass-averaging.')
-# Compute the mass-averaged quantities for each non-empty uniform grid interval !Parallelize!
-for i in range(0,ngridpts_rank):
-    if(len(r_int_cont[i]) != 0):
-        # Interval [ugrid['rad_cm_inn'][i],ugrid['rad_cm_out'][i]]
-        # Compute edge contributions
-
-        ## Set Left Edge Data, 0 if there is a model point at ri (i=0)
-        leftData = np.array([0.0 for v in vars.keys()])
-        k = r_int_cont[i][0]
-        leftVol = 0.0
-        leftMass = 0.0
-        ## If we aren't at the first point and no model point at r ...
-        if((i!=0 or mpi_rank!=0) and ugrid['rad_cm_inn'][i]!=mstar['rcminner'][k]):
-            leftData = np.array([mstar[v][k-1] for v in vars.keys()])
-            ri = ugrid['rad_cm_inn'][i]
-            ro = mstar['radiuscm'][k-1]
-            leftVol = (ri**2 + ri*ro + ro**2)*(ro-ri)
-            leftMass = mstar['density'][k-1]*leftVol
-            for vark in vars.keys():
-                varv = vars[vark]
-                if vark != 'density':
-                    leftData[varv] = leftData[varv]*leftMass # divide and multiply by total left Mass
-            leftData[vars['density']] = (leftMass**2)/leftVol
-
-        ## Set Right Edge Data
-        ### 0 for the quantities if we are at the last grid interval
-        rightData = np.array([0.0 for v in vars.keys()])
-        rightVol = 0.0
-        rightMass = 0.0
-        # ki: index to the model point just beyond the last in this grid interval
-        ro = ugrid['rad_cm_out'][i]
-        ki = r_int_cont[i][-1]+1
-        if (ki!=npts):
-            ri = mstar['rcminner'][ki]
-            if (ri < ro): 
-                rightData = np.array([mstar[v][ki] for v in vars.keys()])
-                rightVol = (ro**2 + ro*ri + ri**2)*(ro-ri)
-                rightMass = mstar['density'][ki]*rightVol
-                for vark in vars.keys():
-                    varv = vars[vark]
-                    if vark != 'density':
-                        rightData[varv] = rightData[varv]*rightMass 
-                rightData[vars['density']] = (rightMass**2)/rightVol
-
-        ## Perform the averaging to fill the uniform grid
-        ### Get partial sum over the MESA zones fully inside the uniform grid interval
-        intervalData = np.array([0.0 for v in vars.keys()])
-        intervalMass = 0.0
-        intervalVol = 0.0
-        for k in r_int_cont[i][0:-1]:
-            ri = mstar['rcminner'][k]
-            ro = mstar['radiuscm'][k]
-            kVol = (ro**2 + ro*ri + ri**2)*(ro-ri)
-            kMass = mstar['density'][k]*kVol
-            intervalVol = intervalVol + kVol
-            intervalMass = intervalMass + kMass
-            kData = np.array([mstar[v][k] for v in vars.keys()])
-            intervalData = intervalData + kMass*kData
-        sumData = intervalData+leftData+rightData 
-        sumMass = leftMass + rightMass + intervalMass
-        sumVol = leftVol + rightVol + intervalVol 
-        for vark in vars.keys():
-            varv = vars[vark]
-            if vark != 'density':
-                ugrid[vark][i] = sumData[varv]/sumMass
-        ugrid['density'][i] = sumMass/sumVol
-        if (i==0):
-            print('Rank: ' + str(mpi_rank) + ', r_int_cont[0]: ' + str(r_int_cont[i]) + ', leftMass: ' + str(leftMass) + ', rightMass: ' + str(rightMass) + ', intervalMass: ' + str(intervalMass))
-       #  Some print statements possibly useful diagnostically
-       # print('r_int_cont[i]: ' + str(r_int_cont[i]))
-       # print('leftMass: ' + str(leftMass))
-       # print('rightMass: ' + str(rightMass))
-       # print('intervalMass: ' + str(intervalMass))
-       # print('leftVol: ' + str(leftVol))
-       # print('rightVol: ' + str(rightVol))
-       # print('intervalVol: ' +  str(intervalVol))
-print('Rank: ' + str(mpi_rank) + ' completed mass-averaging.')
-                
-# Mass-averaged quantities for all non-empty grid intervals have been computed.
-# Now interpolate between grid intervals to compute quantities for the empty 
-# grid intervals.
-prevkB = 0
-prevkC = 0
-coef_t = np.array([0.0,0.0,0.0,0.0]) # coefficients for poly interp up to 3rd order
-coeffs = OrderedDict([(k,coef_t) for k in vars.keys()])
-
-def dinject(u,m):
-    # u: index of cell in ugrid to inject into
-    # m: index of cell in mstar to inject from
-    global ugrid
-    global mstar
-    global vars
-    for vark in vars.keys():
-        ugrid[vark][u] = mstar[vark][m]
-
-print('Rank: ' + str(mpi_rank) + ' beginning interpolation.')
-for i in range(len(r_int_empty)): # !Parallelize!
-# The quantities in the empty grid intervals are set by quadratic interpolation
-# depending only on the quantities in the previous and next non-empty intervals
-# Once an empty grid interval's values are computed, it is not used for 
-# further interpolation if, e.g., there are several consecutive empty intervals
-# Neither the first nor the last grid intervals should be empty so we
-# don't have to worry about them here.
-
-        if (r_int_empty[i] == 0 or r_int_empty[i] == ngridpts_rank-1):
-            print('Rank: ' + str(mpi_rank) + ', r_int_empty: ' + str(r_int_empty[i]) + ', r_int_empty_zones: ' + str(r_int_empty_zones[i]) + ', rad_cm_ctr[i]: ' + str(ugrid['rad_cm_ctr'][r_int_empty[i]]))
-
-        nz = len(r_int_empty_zones[i])
-        if nz==2:
-            kB = r_int_empty_zones[i][0]
-            kC = r_int_empty_zones[i][1]
-        elif nz==1:
-            j = r_int_empty[i]
-            k = r_int_empty_zones[i][0]
-            if ((k==npts-1) or (k!=0 and (ugrid['rad_cm_ctr'][j] < mstar['rad_cm_ctr'][k]))):
-                kB = k-1
-                kC = k
-            elif (k==0 or (ugrid['rad_cm_ctr'][j] > mstar['rad_cm_ctr'][k])):
-                kB = k
-                kC = k+1
-            else:
-                # Do direct injection if the grid and mstar cell centers exactly line up
-                dinject(j,k)
-                continue
-        else:
-            print('ERROR: nz neither 2 nor 1, nz=' + str(nz))
-            sys.exit()
-
-       # print('kB: ' + str(kB))
-       # print('kC: ' + str(kC))
-       # print('nz: ' + str(nz))
-       # print('r_int_empty[' + str(i) + ']: ' + str(r_int_empty[i]))
-       # print('r_int_empty_zones[' + str(i) + ']: ' + str(r_int_empty_zones[i]))
-
-        ## Do interpolation if you can't reuse the previous coefficients
-        if ((kB != prevkB or kC != prevkC)):
-#            print('kB: ' + str(kB))
-#            print('kC: ' + str(kC))
-            # Find quadratic coefficients for all variables via least-squares fitting
-            # using two model points on either side if they exist, otherwise shift to an extra left or right
-            if cubic:
-                klist = [kB-1,kB,kC,kC+1]
-                if(kB == 0):
-                    klist = [kB,kC,kC+1,kC+2]
-                elif(kC == npts-1):
-                    klist = [kB-2,kB-1,kB,kC]
-            elif quad:
-                klist = [kB-1,kB,kC]
-                if(kB == 0):
-                    klist = [kB,kC,kC+1]
-            elif linear:
-                klist = [kB,kC]
-#            print('klist: ' + str(klist))
-            rpows = np.array([[(mstar['rad_cm_ctr'][ki])**n for ki in klist] for n in range(0,2*poly_n+1)])
-            rmat = np.array([[sum(rpows[j]) for j in range(k+poly_n,k-1,-1)] for k in range(poly_n,-1,-1)])
-            for vark in vars.keys():
-                #Solve an equation of the form rmat*coeffs=fmat
-                fvec = np.array([mstar[vark][ki] for ki in klist])
-                fmat = np.array([np.dot(fvec,rpows[j]) for j in range(poly_n,-1,-1)])
-                coeffs[vark] = np.linalg.solve(rmat,fmat)  
-
-        rgrid = ugrid['rad_cm_ctr'][r_int_empty[i]]
-        for vark in vars.keys():
-            ugrid[vark][r_int_empty[i]] = sum([coeffs[vark][-(j+1)]*(rgrid**j) for j in range(poly_n,-1,-1)])
-           
-    ## Following is a test case for the linear interpolation above 
-       # if(linear):
-       #     kB = r_int_cont[kB][-1]
-       #     kC = r_int_cont[kC][0]
-       #     rB = mstar['rad_cm_ctr'][kB]
-       #     rC = mstar['rad_cm_ctr'][kC]
-       #     rgrid = ugrid['rad_cm_ctr'][r_int_empty[i]]
-       #     for vark in vars.keys():
-       #         ugrid[vark][r_int_empty[i]] = mstar[vark][kB] + (mstar[vark][kC]-mstar[vark][kB])*(rgrid-rB)/(rC-rB)
-
-        prevkB = kB
-        prevkC = kC
-print('Rank: ' + str(mpi_rank) + ' completed interpolation.')
-
-## Now renormalize all abundances (in case mass-averaging and quadratic interpolation broke normalization)
-for i in range(0,ngridpts_rank):
-    sumx = 0.0
-    for x in varx.keys():
-        sumx = sumx + ugrid[x][i]
-    for x in varx.keys():
-        ugrid[x][i] = ugrid[x][i]/sumx
-
-def esf(x):
-        return '{0:0.15e}'.format(x)
-
-# Bring parallel data back to main
-if (mpi_rank == 0):
-    print('Gathering ugrid data.')
-for k in ugkeys:
-    ugrid[k] = mpi_comm.gather(ugrid[k],root=0)
+    if (mpi_rank == 0):
+        # Pack the star into one (zones, fields) buffer, repeating the zones
+        # shared by neighboring processes so each gets a contiguous block
+        star_buf = np.concatenate([star_buf[zone_start[i]:zone_end[i]] for i in range(mpi_size)])
+    else:
+        grid_buf = None
+        star_buf = None
+        meta = None
+
+    # Pass the (small) bookkeeping data from root to processes, then
+    # scatter the grid and star buffers
+    vars, varx, star_fields, npts, ngridpts, elements_rank, start_rank, zone_start, zone_end, cost_rank = mpi_comm.bcast(meta,root=0)
+    nfields = len(star_fields)
+    zones_rank = [zone_end[i]-zone_start[i] for i in range(mpi_size)]
+
+    grid_local = np.empty((elements_rank[mpi_rank],3), dtype=np.float64)
+    mpi_comm.Scatterv([grid_buf, [3*n for n in elements_rank], [3*n for n in start_rank], MPI.DOUBLE],
+                      grid_local, root=0)
+    star_local = np.empty((zones_rank[mpi_rank],nfields), dtype=np.float64)
+    mpi_comm.Scatterv([star_buf, [nfields*n for n in zones_rank],
+                       [nfields*sum(zones_rank[0:i]) for i in range(mpi_size)], MPI.DOUBLE],
+                      star_local, root=0)
+
+    # mstar now holds the local MESA zones zone_start[mpi_rank], ..., zone_end[mpi_rank]-1
+    mstar = OrderedDict([(k, star_local[:,n]) for n, k in enumerate(star_fields)])
+
+    print('Rank: ' + str(mpi_rank) + ' elements_rank is... ' + str(elements_rank))
+    print('Rank: ' + str(mpi_rank) + ' MESA zones: ' + str(zone_start[mpi_rank]) + ' to ' + str(zone_end[mpi_rank]))
+
+    # Mass-average the grid intervals containing MESA zones, interpolate
+    # the empty ones and renormalize the abundances (see MesaRemap.remap_block)
+    print('Rank: ' + str(mpi_rank) + ' beginning remap.')
+    time_start = wtime()
+    ugrid_local = remap_block(mstar, grid_local, list(vars.keys()), list(varx.keys()), poly_n,
+                              start=start_rank[mpi_rank], zone_start=zone_start[mpi_rank], npts=npts)
+    time_rank = mpi_comm.gather(wtime() - time_start, root=0)
+    print('Rank: ' + str(mpi_rank) + ' completed remap.')
+
+    # Bring parallel data back to main
+    if (mpi_rank == 0):
+        print('Gathering ugrid data.')
+        ugrid_buf = np.empty((ngridpts,len(vars)), dtype=np.float64)
+    else:
+        ugrid_buf = None
+    mpi_comm.Gatherv(ugrid_local, [ugrid_buf, [len(vars)*n for n in elements_rank],
+                                   [len(vars)*n for n in start_rank], MPI.DOUBLE], root=0)
 
 if (mpi_rank == 0):
-    # Convert ugrid to ugrid_from_gather
-    #ugrid_from_gather = OrderedDict([])
-    #for k in ugkeys:
-    #    ugrid_from_gather[k] = np.empty(ngridpts,np.float64)
-    #    for i in range(mpi_size):
-    #        ugrid_from_gather[k][start_rank[i]:elements_rank[i]+start_rank[i]] = ugrid[k][i]
+    # Compare the work each process was predicted to get with its remap time
+    # (the predicted time splits the total remap time in proportion to cost)
+    total_cost = sum(cost_rank)
+    total_time = sum(time_rank)
+    print('Rank  intervals  predicted cost  predicted time (s)  achieved time (s)')
+    for i in range(mpi_size):
+        predicted = total_time*cost_rank[i]/total_cost if total_cost > 0 else 0.0
+        print('{:4d}  {:9d}  {:14.0f}  {:18.6f}  {:17.6f}'.format(i, elements_rank[i], cost_rank[i],
+                                                               predicted, time_rank[i]))
+    if total_time > 0:
+        print('Load imbalance (max/mean time): {:.3f}'.format(max(time_rank)*mpi_size/total_time))
 
     print('Rank: ' + str(mpi_rank) + ' printing grid data.')
     # All grid intervals have now been computed, time to print out the grid data...
-    gridFile = open(gridFileName,'w')
-    
-    ## Write header
-    modelHeader = '#  ' + 'radius  '
-    for vark in vars.keys():
-        modelHeader = modelHeader + vark + '  '
-    gridFile.write(modelHeader + '\n')
-    
-    ## Write number of grid points
-    gridFile.write(str(ngridpts)+'\n')
-    
-    ## Write the grid data
-    for i in range(mpi_size):
-        for j in range(elements_rank[i]):
-            gridFile.write(str(esf(ugrid['rad_cm_ctr'][i][j])) + ' ')
-            for vark in vars.keys():
-                gridFile.write(str(esf(ugrid[vark][i][j])) + ' ')
-            gridFile.write('\n')
-    
-    ## Close the grid file
-    gridFile.close()
-    
+    gridFile = GridFileWriter(gridFileName, list(vars.keys()), ngridpts, args.format)
+    try:
+        gridFile.write(grid_buf[:,1], ugrid_buf)
+    except BaseException:
+        gridFile.discard()
+        raise
+    gridFile.finish()
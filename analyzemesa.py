@@ -3,11 +3,16 @@ import numpy as np
 import matplotlib.pyplot as plt
 from collections import OrderedDict
 from MesaProfile import MesaProfile
+from MesaRemap import write_rows
 import argparse
 
 parser = argparse.ArgumentParser()
 parser.add_argument("dataset", type=str, help="Name of the input dataset.")
 parser.add_argument("-o", "--output", type=str, help="Name of the output dataset file to write.")
+parser.add_argument("-c", "--columns", type=str, nargs="+",
+                    default=['mass', 'radius', 'logRho', 'pressure', 'temperature', 'ye',
+                             'c12', 'o16', 'ne20', 'ne22', 'na23', 'mg24'],
+                    help="Names of the MESA profile fields to read. Default is the fields used below.")
 args = parser.parse_args()
 
 # Set output file name if not supplied
@@ -16,17 +21,11 @@ if args.output:
 else:
         outputfile = 'mapped_' + args.dataset
 
-# Set constant centimeters per solar radius
-cmperRsun = 6.955e10
-
 # Read the input MESA profile
-mesa = MesaProfile()
+mesa = MesaProfile(columns=args.columns)
 mesa.setInProfileName(args.dataset)
 mesa.readProfile()
-mstar = mesa.getStar()
-
-# Create a field for radius in cm instead of Rsun units
-mstar['radiuscm'] = cmperRsun*mstar['radius']
+mstar = mesa.getStar() # radius in cm is mstar['radiuscm'], density mstar['density']
 
 print('Mass: ' + str(mstar['mass'][-1]))
 
@@ -53,7 +52,7 @@ plt.title('Selected MESA Model Abundances')
 plt.figure(2)
 fig = plt.gcf()
 ax1 = fig.add_axes([0.1,0.1,0.8,0.8])
-Rhoplot = ax1.plot(mstar['radiuscm'],10.0**mstar['logRho'],'b')
+Rhoplot = ax1.plot(mstar['radiuscm'],mstar['density'],'b')
 plt.xlabel('Radius (cm)')
 plt.ylabel('Density ($g/cm^3$)')
 #plt.xlim([0,5e7])
@@ -61,7 +60,7 @@ plt.ylabel('Density ($g/cm^3$)')
 plt.title('Central Density Profile')
 
 ## Zone radius separation (dr) distribution
-dr = np.array([mstar['radiuscm'][i+1]-mstar['radiuscm'][i] for i in range(0,len(mstar['radiuscm'])-1)])
+dr = np.diff(mstar['radiuscm'])
 mindr = min(dr)
 
 print('Minimum Radius Separation: ' + str(mindr))
@@ -110,17 +109,10 @@ fout.write('# radius         dens           pres           temp        c12
 numpts = len(fmap['c12']) # Can use something else if, e.g. you mass-average
 fout.write(str(numpts) + '\n')
 
-def esf(x):
-	return '{0:0.15e}'.format(x)
-
-for i in range(0,numpts):
-	fout.write(esf(mstar['radiuscm'][i]) + '  ' +
-			esf(10.0**mstar['logRho'][i]) + '  ' + 
-			esf(mstar['pressure'][i]) + '  ' + 
-			esf(mstar['temperature'][i]) + '  ' +
-			esf(fmap['c12'][i]) + '  ' +
-			esf(fmap['ne20'][i]) + '  ' +
-			esf(fmap['ne22'][i]) + '\n')
+## Format all the rows at once
+block = np.column_stack([mstar['radiuscm'], mstar['density'], mstar['pressure'], mstar['temperature'],
+                         fmap['c12'], fmap['ne20'], fmap['ne22']])
+write_rows(fout, block, sep='  ', trailing=False)
 
 # All done, save file!
 fout.close()
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""
+Remap many MESA profiles onto one grid definition in a single job, as
+UniformMesaGrid.py does for one profile. Whole profiles are distributed
+between MPI ranks or the workers of a local process pool, and each
+process reuses its grid and output buffers for all of its profiles.
+
+Remap a LOGS sequence onto a 4 km uniform grid with 6 MPI ranks:
+    mpiexec -np 6 python batch_remap.py LOGS/profile*.data -drcm=4e5 -ip=2 -mfx -d gridded
+
+Or in a local process pool, without MPI:
+    batch_remap.py LOGS/profile*.data -drcm=4e5 -ip=2 -b pool -np 8 -d gridded
+
+Each profile is written to OUTPUT_DIR/<profile name><SUFFIX>, so the profiles
+of one run must have distinct file names.
+
+Relies on mesautils, part of Flash-Star.
+"""
+from __future__ import print_function
+import os
+import sys
+import argparse
+import numpy as np
+from MesaRemap import remap_profiles
+
+parser = argparse.ArgumentParser()
+parser.add_argument('profiles', type=str, nargs='+', help='Names of the input MESA profiles.')
+parser.add_argument('-drcm', '--delta_radius_cm', type=float, help='Step size to use in radius in units of cm.')
+parser.add_argument('-e', '--edges', type=str, help='Text file of increasing interval edge radii in cm to remap onto, instead of a uniform grid.')
+parser.add_argument('-ip', '--interpolation', type=int, choices=[1, 2, 3], required=True, help='Interpolation type to use. 1 = Linear, 2 = Quadratic, 3 = Cubic.')
+parser.add_argument('-mfx', '--map_abundances_flash', action='store_true', help='Map the MESA abundances to FLASH reduced composition: C12, O16, Ne20, Ne22.')
+parser.add_argument('-d', '--output_dir', type=str, default='.', help='Directory to write the grid files to. Default is the current directory.')
+parser.add_argument('-s', '--suffix', type=str, default='.uniform.dat', help="Suffix appended to each profile name to name its grid file. Default is '.uniform.dat'.")
+parser.add_argument('-f', '--format', type=str, choices=['text', 'raw', 'npy'], default='text', help='Output format, as for UniformMesaGrid.py.')
+parser.add_argument('-b', '--backend', type=str, choices=['mpi', 'pool'], help='Parallel backend: mpi (run under mpiexec) or pool (a local process pool, no MPI needed). Default is mpi if mpi4py is installed, otherwise pool.')
+parser.add_argument('-np', '--processes', type=int, help='Number of processes for the pool backend. Default is one per core; 1 runs serially without a pool.')
+args = parser.parse_args()
+
+if (args.delta_radius_cm is None) == (args.edges is None):
+    print('ERROR: SPECIFY EITHER A GRID SPACING WITH -drcm OR GRID EDGES WITH -e.')
+    sys.exit()
+
+if args.backend is None:
+    # Use MPI where it is available, as UniformMesaGrid.py does
+    try:
+        import mpi4py
+        args.backend = 'mpi'
+    except ImportError:
+        args.backend = 'pool'
+
+if args.backend == 'mpi':
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+    rank = comm.Get_rank()
+else:
+    comm = None
+    rank = 0
+
+edges = np.loadtxt(args.edges, ndmin=1) if args.edges else None
+outputs = [os.path.join(args.output_dir, os.path.basename(p) + args.suffix) for p in args.profiles]
+# Profiles of the same name from different directories would overwrite each other
+seen = {}
+for p, o in zip(args.profiles, outputs):
+    if o in seen:
+        parser.error(p + ' and ' + seen[o] + ' would both be written to ' + o + '; remap them in separate runs or output directories.')
+    seen[o] = p
+if rank == 0 and not os.path.isdir(args.output_dir):
+    os.makedirs(args.output_dir)
+if comm is not None:
+    comm.Barrier()
+
+done = remap_profiles(args.profiles, outputs, args.interpolation, Dr=args.delta_radius_cm, edges=edges,
+                      map_flash=args.map_abundances_flash, format=args.format,
+                      processes=args.processes, comm=comm)
+for pname, ngridpts, error in done:
+    if error is None:
+        print('Rank: {} wrote {} grid intervals for {}'.format(rank, ngridpts, pname))
+    else:
+        print('Rank: {} ERROR remapping {}: {}'.format(rank, pname, error))
@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+"""
+Build or query a header-only catalog of the profiles in MESA LOGS directories.
+
+Build a catalog:
+    catalog_profiles.py run1/LOGS run2/LOGS -o catalog.npz
+
+Query a catalog without touching any profile:
+    catalog_profiles.py -i catalog.npz --closest star_age 1.0e9
+    catalog_profiles.py -i catalog.npz --less star_mass 1.2
+
+Relies on mesautils, part of Flash-Star.
+"""
+from __future__ import print_function
+from MesaCatalog import MesaCatalog
+import argparse
+
+parser = argparse.ArgumentParser()
+parser.add_argument("logs", type=str, nargs="*", help="LOGS directories to catalog.")
+parser.add_argument("-o", "--output", type=str, default="catalog.npz",
+                    help="Name of the catalog file to write. Default is 'catalog.npz'.")
+parser.add_argument("-i", "--input", type=str, help="Name of an existing catalog file to query.")
+parser.add_argument("-p", "--pattern", type=str, default="profile*.data",
+                    help="Pattern matching the profiles in each LOGS directory. Default is 'profile*.data'.")
+parser.add_argument("-np", "--processes", type=int, help="Number of processes to read headers with. Default is one per core.")
+parser.add_argument("--closest", type=str, nargs=2, metavar=("FIELD", "VALUE"),
+                    help="Print the profile whose header FIELD is closest to VALUE.")
+parser.add_argument("--less", type=str, nargs=2, metavar=("FIELD", "VALUE"),
+                    help="Print the profiles whose header FIELD is less than VALUE.")
+parser.add_argument("--greater", type=str, nargs=2, metavar=("FIELD", "VALUE"),
+                    help="Print the profiles whose header FIELD is greater than VALUE.")
+args = parser.parse_args()
+
+catalog = MesaCatalog()
+if args.input:
+    catalog.load(args.input)
+else:
+    catalog.build(args.logs, pattern=args.pattern, processes=args.processes)
+    catalog.save(args.output)
+    print('Wrote {} profiles to {}'.format(len(catalog.table['path']), args.output))
+
+if args.closest:
+    print(catalog.closest(args.closest[0], float(args.closest[1])))
+if args.less:
+    for p in catalog.select(catalog.table[args.less[0]] < float(args.less[1])):
+        print(p)
+if args.greater:
+    for p in catalog.select(catalog.table[args.greater[0]] > float(args.greater[1])):
+        print(p)
@@ -1,9 +1,21 @@
+import re
+import numpy as np
+
 class Element(object):
     def __init__(self, abbreviation=None, name=None, Z=None):
         self.abbreviation = abbreviation
         self.name = name
         self.Z = Z
 
+class Isotope(object):
+    def __init__(self, name=None, element=None, A=None, column=None):
+        self.name = name
+        self.element = element
+        self.Z = element.Z if element else None
+        self.A = A
+        # Index of the isotope's field in a profile's data, if any
+        self.column = column
+
 class UnidentifiedElement(BaseException):
     def __init__(self):
         return
@@ -128,12 +140,62 @@ class PeriodicTable(object):
              'ts': Element('ts', 'tennessine', 117),
              'og': Element('og', 'oganesson', 118)}
 
+    isotope_pattern = re.compile('^([a-z]+)([1-9][0-9]{0,2})$')
+
     def __init__(self):
         return
 
+    @classmethod
+    def lookup_isotope(self, name, column=None):
+        # Return an Isotope for names like 'c12' made of a lowercase element
+        # abbreviation and a mass number from 1 to 999, as in MESA profiles
+        m = self.isotope_pattern.match(name)
+        if not m or not m.group(1) in self.table:
+            raise UnidentifiedElement
+        return Isotope(name, self.table[m.group(1)], int(m.group(2)), column)
+
+    # Cache of the Z and A vectors of lists of isotope names (see isotope_vectors)
+    isotope_vectors_cache = {}
+
+    @classmethod
+    def isotope_vectors(self, names):
+        # Return (Z, A), float64 arrays of the charge and mass number of each
+        # isotope in names, e.g. the isotope columns of a profile or grid.
+        # The arrays are computed once per list of names and shared, so
+        # they must not be modified.
+        key = tuple(names)
+        if key not in self.isotope_vectors_cache:
+            isotopes = [self.lookup_isotope(n) for n in names]
+            Z = np.array([i.Z for i in isotopes], dtype=np.float64)
+            A = np.array([i.A for i in isotopes], dtype=np.float64)
+            Z.flags.writeable = False
+            A.flags.writeable = False
+            self.isotope_vectors_cache[key] = (Z, A)
+        return self.isotope_vectors_cache[key]
+
     @classmethod
     def lookup_abbreviation(self, abbrev):
         try:
             return self.table[abbrev.lower()]
         except:
             raise UnidentifiedElement
+
+# Composition quantities of a (zones, isotopes) block of mass fractions X,
+# with Z and A the charge and mass numbers of its isotope columns
+# (see PeriodicTable.isotope_vectors), each one matrix-vector product.
+
+def mass_fraction_sum(X):
+    # Sum of the mass fractions of each zone
+    return X.dot(np.ones(X.shape[1]))
+
+def ye(X, Z, A):
+    # Electron fraction Ye = sum(X*Z/A) of each zone
+    return X.dot(Z/A)
+
+def abar(X, Z, A):
+    # Mean mass number Abar = sum(X)/sum(X/A) of each zone
+    return mass_fraction_sum(X)/X.dot(1.0/A)
+
+def zbar(X, Z, A):
+    # Mean charge Zbar = sum(X*Z/A)/sum(X/A) of each zone
+    return X.dot(Z/A)/X.dot(1.0/A)
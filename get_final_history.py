@@ -19,18 +19,16 @@ parser.add_argument("-f", "--fields", type=str, nargs="+", default=["star_mass"]
                     help="Name of the field(s) for which to get the final values. Default is 'star_mass'.")
 args = parser.parse_args()
 
-ms = MesaProfile(args.infile)
+try:
+    ms = MesaProfile(args.infile, columns=args.fields, last_row=True)
+except ValueError:
+    print('fieldnotfounderror')
+    exit()
 s = ms.star
 
 v = []
 for k in args.fields:
-    try:
-        assert(k in s.keys())
-    except:
-        print('fieldnotfounderror')
-        exit()
-    else:
-        v.append('{}'.format(s[k][-1]))
+    v.append('{}'.format(s[k][-1]))
 
 values = ' '.join(v)
 print(values)
@@ -14,8 +14,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument("infile", type=str, help="Supply the MESA history file from which to get the fields.")
 args = parser.parse_args()
 
-ms = MesaProfile(args.infile)
-s = ms.star
+ms = MesaProfile(args.infile, header_only=True)
 
-for k in s.keys():
+for k in ms.getZoneFields():
     print(k)
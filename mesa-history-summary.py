@@ -12,7 +12,7 @@ parser = argparse.ArgumentParser()
 parser.add_argument("infile", type=str, help="Supply the MESA history file from which to make the HR diagram.")
 args = parser.parse_args()
 
-ms = MesaProfile(args.infile)
+ms = MesaProfile(args.infile, columns=['star_age', 'log_L', 'log_Teff'])
 s = ms.star
 
 # Plot Log Luminosity vs. Star Age (yr)
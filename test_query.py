@@ -0,0 +1,45 @@
+from __future__ import print_function
+import numpy as np
+from collections import OrderedDict
+from MesaQuery import MesaQuery
+
+## Checks of MesaQuery on a synthetic profile, needing no MESA output:
+## run as a script, or with pytest.
+
+def synthetic_star(npts=100):
+    x = np.linspace(0.0, 1.0, npts+1)[1:]
+    star = OrderedDict([])
+    star['radius'] = 1.0e-2*x**2 + 1.0e-4*x
+    star['logRho'] = 7.0 - 6.0*x
+    star['temperature'] = 1.0e9*np.exp(-3.0*x)
+    return star
+
+def test_outside_star():
+    # Queries beyond the star are answered at its edges, for every order
+    star = synthetic_star()
+    for poly_n in (1, 2, 3):
+        query = MesaQuery(star, poly_n=poly_n, vars=['density', 'temperature'])
+        inner = query.at(radius=query.rcminner[0])
+        outer = query.at(radius=query.radiuscm[-1])
+        q = query.at(radius=np.array([-1.0e5, 1.0e12, 1.0e20]))
+        assert np.array_equal(q['radius'], [query.rcminner[0], query.radiuscm[-1], query.radiuscm[-1]])
+        assert np.array_equal(q['mass'], [0.0, query.total_mass, query.total_mass])
+        for v in ('density', 'temperature'):
+            assert np.all(q[v] > 0.0)
+            assert q[v][0] == inner[v][0]
+            assert np.all(q[v][1:] == outer[v][0])
+        m = query.at(mass=np.array([-1.0, 2.0*query.total_mass]))
+        assert np.allclose(m['density'], q['density'][:2], rtol=1.0e-12, atol=0.0)
+
+def test_zone_centers():
+    # A query at a zone center returns the zone's values
+    star = synthetic_star()
+    query = MesaQuery(star, poly_n=2, vars=['density', 'temperature'])
+    q = query.at(radius=query.rad_cm_ctr)
+    assert np.array_equal(q['density'], query.density)
+    assert np.array_equal(q['temperature'], star['temperature'])
+
+if __name__ == '__main__':
+    for test in (test_outside_star, test_zone_centers):
+        test()
+        print(test.__name__ + ': OK')
@@ -0,0 +1,284 @@
+from __future__ import print_function
+import os
+import shutil
+import tempfile
+import numpy as np
+from collections import OrderedDict
+from MesaRemap import (star_geometry, find_overlaps, zone_integrals, mass_average, uniform_grid, edges_grid,
+                       uniform_grid_chunks, MesaRemapper, GridFileWriter)
+
+## Regression checks of the remap on a synthetic profile, needing no MESA
+## output: run as a script, or with pytest.
+
+def synthetic_star(npts=300):
+    # A profile whose zones widen outward, so that a uniform grid has
+    # intervals containing many zones near the center and empty intervals
+    # in the envelope.
+    x = np.linspace(0.0, 1.0, npts+1)[1:]
+    star = OrderedDict([])
+    star['zone'] = np.arange(npts, 0, -1, dtype=np.float64)
+    star['radius'] = 1.0e-2*x**3 + 1.0e-4*x
+    star['logRho'] = 7.0 - 6.0*x
+    star['temperature'] = 1.0e9*np.exp(-3.0*x)
+    star['ye'] = 0.5 - 0.02*x**2
+    star['c12'] = 0.3 + 0.2*np.sin(7.0*x)**2
+    star['o16'] = 1.0 - star['c12']
+    return star_geometry(star)
+
+def reference_overlaps(star, grid):
+    # The original per-interval search over all zones
+    rcminner = star['rcminner']
+    radiuscm = star['radiuscm']
+    r_int_cont = []
+    r_int_empty = []
+    r_int_empty_zones = []
+    for i in range(len(grid)):
+        rint_cont = []
+        j_contains = []
+        for j in range(len(radiuscm)):
+            if rcminner[j] >= grid[i,0] and radiuscm[j] <= grid[i,2]:
+                rint_cont.append(j)
+            if ((rcminner[j] < grid[i,0] and radiuscm[j] > grid[i,0]) or
+                (radiuscm[j] > grid[i,2] and rcminner[j] < grid[i,2])):
+                j_contains.append(j)
+        r_int_cont.append(rint_cont)
+        if len(rint_cont) == 0:
+            r_int_empty.append(i)
+            r_int_empty_zones.append(j_contains)
+    return r_int_cont, r_int_empty, r_int_empty_zones
+
+def reference_mass_average(star, grid, vars, r_int_cont):
+    # The original per-interval mass average, including its quirks: the last
+    # contained zone is only counted through the right edge, and the first
+    # interval gets no contribution from the left
+    rcminner = star['rcminner']
+    radiuscm = star['radiuscm']
+    density = star['density']
+    npts = len(radiuscm)
+    rho = np.full(len(grid), np.nan)
+    avg = np.full((len(grid), len(vars)), np.nan)
+    for i in range(len(grid)):
+        if len(r_int_cont[i]) == 0:
+            continue
+        leftData = np.zeros(len(vars))
+        leftVol = 0.0
+        leftMass = 0.0
+        k = r_int_cont[i][0]
+        if i != 0 and grid[i,0] != rcminner[k]:
+            ri = grid[i,0]
+            ro = radiuscm[k-1]
+            leftVol = (ri**2 + ri*ro + ro**2)*(ro-ri)
+            leftMass = density[k-1]*leftVol
+            leftData = np.array([star[v][k-1] for v in vars])*leftMass
+        rightData = np.zeros(len(vars))
+        rightVol = 0.0
+        rightMass = 0.0
+        ro = grid[i,2]
+        ki = r_int_cont[i][-1]+1
+        if ki != npts and rcminner[ki] < ro:
+            ri = rcminner[ki]
+            rightVol = (ro**2 + ro*ri + ri**2)*(ro-ri)
+            rightMass = density[ki]*rightVol
+            rightData = np.array([star[v][ki] for v in vars])*rightMass
+        intervalData = np.zeros(len(vars))
+        intervalMass = 0.0
+        intervalVol = 0.0
+        for k in r_int_cont[i][0:-1]:
+            ri = rcminner[k]
+            ro = radiuscm[k]
+            kVol = (ro**2 + ro*ri + ri**2)*(ro-ri)
+            kMass = density[k]*kVol
+            intervalVol = intervalVol + kVol
+            intervalMass = intervalMass + kMass
+            intervalData = intervalData + kMass*np.array([star[v][k] for v in vars])
+        sumMass = leftMass + rightMass + intervalMass
+        rho[i] = sumMass/(leftVol + rightVol + intervalVol)
+        avg[i] = (intervalData + leftData + rightData)/sumMass
+    return rho, avg
+
+def check_overlaps(star, grid):
+    # Compare find_overlaps with the reference search, returning the number of empty intervals
+    cont_lo, cont_hi, empty, empty_zones = find_overlaps(star['rcminner'], star['radiuscm'],
+                                                         grid[:,0], grid[:,2])
+    r_int_cont, r_int_empty, r_int_empty_zones = reference_overlaps(star, grid)
+    for i in range(len(grid)):
+        assert list(range(cont_lo[i], cont_hi[i])) == r_int_cont[i]
+    assert list(empty) == r_int_empty
+    for e, zones in enumerate(r_int_empty_zones):
+        assert [j for j in empty_zones[e] if j >= 0] == zones
+    return len(empty)
+
+def test_find_overlaps():
+    star = synthetic_star()
+    for Dr in (3.0e6, 2.0e7, 1.0e8):
+        grid = uniform_grid(star['rcminner'][0], star['radiuscm'][-1], Dr)
+        assert 0 < check_overlaps(star, grid) < len(grid)
+
+def test_find_overlaps_random():
+    # Random zone and grid layouts, with grid edges falling on zone edges
+    rng = np.random.RandomState(11)
+    for trial in range(50):
+        zone_edges = np.cumsum(rng.uniform(0.1, 1.0, rng.randint(2, 40)))
+        edges = np.concatenate([[0.0], zone_edges])
+        star = {'rcminner': edges[:-1], 'radiuscm': edges[1:]}
+        grid_edges = rng.uniform(0.0, edges[-1], rng.randint(1, 60))
+        shared = rng.choice(edges, rng.randint(0, len(edges)))
+        grid_edges = np.unique(np.concatenate([[0.0, edges[-1]], grid_edges, shared]))
+        check_overlaps(star, edges_grid(grid_edges))
+
+def test_mass_average():
+    star = synthetic_star()
+    vars = ['temperature', 'ye', 'c12', 'o16']
+    values = np.column_stack([star[v] for v in vars])
+    for Dr in (3.0e6, 2.0e7, 1.0e8):
+        grid = uniform_grid(star['rcminner'][0], star['radiuscm'][-1], Dr)
+        cont_lo, cont_hi, empty, empty_zones = find_overlaps(star['rcminner'], star['radiuscm'],
+                                                             grid[:,0], grid[:,2])
+        rho, avg = mass_average(star['rcminner'], star['radiuscm'], star['density'], values,
+                                grid[:,0], grid[:,2], cont_lo, cont_hi)
+        r_int_cont = [list(range(lo, hi)) for lo, hi in zip(cont_lo, cont_hi)]
+        ref_rho, ref_avg = reference_mass_average(star, grid, vars, r_int_cont)
+        assert np.array_equal(np.isnan(rho), np.isnan(ref_rho))
+        full = ~np.isnan(ref_rho)
+        assert np.allclose(rho[full], ref_rho[full], rtol=1.0e-13, atol=0.0)
+        assert np.allclose(avg[full], ref_avg[full], rtol=1.0e-13, atol=0.0)
+        ## A zone slice with start and integrals, as the MPI ranks use it
+        half = len(grid)//2
+        lo = max(cont_lo[half]-2, 0)
+        s = slice(lo, None)
+        rho2, avg2 = mass_average(star['rcminner'][s], star['radiuscm'][s], star['density'][s], values[s],
+                                  grid[half:,0], grid[half:,2], cont_lo[half:]-lo, cont_hi[half:]-lo,
+                                  start=half, integrals=zone_integrals(star['rcminner'][s], star['radiuscm'][s],
+                                                                       star['density'][s], values[s]))
+        assert np.array_equal(rho2, rho[half:], equal_nan=True)
+        assert np.array_equal(avg2, avg[half:], equal_nan=True)
+
+def remapped(ugrid, vars):
+    # The remapped variables of remapGrid's dictionary as one array
+    return np.column_stack([ugrid[v] for v in vars])
+
+def test_pool():
+    # The process pool backend must match the remap in this process exactly
+    star = synthetic_star()
+    vars = ['density', 'temperature', 'ye', 'c12', 'o16']
+    varx = ['c12', 'o16']
+    for poly_n in (1, 2, 3):
+        remapper = MesaRemapper(star, poly_n=poly_n, vars=vars, varx=varx)
+        pooled = MesaRemapper(star, poly_n=poly_n, vars=vars, varx=varx, processes=3)
+        for Dr in (3.0e6, 2.0e7):
+            values = remapped(remapper.remapGrid(remapper.uniformGrid(Dr)), vars)
+            assert np.all(np.isfinite(values))
+            assert np.allclose(values[:,3] + values[:,4], 1.0, rtol=0.0, atol=1.0e-14)
+            assert np.array_equal(remapped(pooled.remapGrid(pooled.uniformGrid(Dr)), vars), values)
+
+def write_whole(name, remapper, Dr, format='text'):
+    # Write the remap of the whole uniform grid of spacing Dr at once
+    ugrid = remapper.remapGrid(remapper.uniformGrid(Dr))
+    values = remapped(ugrid, remapper.vars)
+    gridFile = GridFileWriter(name, remapper.vars, len(values), format)
+    gridFile.write(ugrid['rad_cm_ctr'], values)
+    gridFile.finish()
+    return len(values)
+
+def same_file(a, b):
+    # Whether files a and b hold the same bytes
+    with open(a, 'rb') as fa, open(b, 'rb') as fb:
+        return fa.read() == fb.read()
+
+def test_stream():
+    # Streaming in chunks of any size must write the file of the whole grid
+    star = synthetic_star()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        whole = os.path.join(tmpdir, 'whole.dat')
+        streamed = os.path.join(tmpdir, 'streamed.dat')
+        for poly_n in (1, 2, 3):
+            remapper = MesaRemapper(star, poly_n=poly_n, vars=['density', 'temperature', 'ye', 'c12', 'o16'],
+                                    varx=['c12', 'o16'])
+            for Dr in (3.0e6, 2.0e7):
+                r_inn, r_out = star['rcminner'][0], star['radiuscm'][-1]
+                chunks = [grid for start, grid in uniform_grid_chunks(r_inn, r_out, Dr, 7)]
+                assert np.array_equal(np.concatenate(chunks), uniform_grid(r_inn, r_out, Dr))
+                n = write_whole(whole, remapper, Dr)
+                for chunk_size in (1, 7, 1000000):
+                    assert remapper.remapStream(Dr, streamed, chunk_size=chunk_size) == n
+                    assert same_file(whole, streamed)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_formats():
+    # The binary formats hold the same rows as the text format, with its
+    # header lines in the sidecar, whether written whole or streamed
+    star = synthetic_star()
+    remapper = MesaRemapper(star, poly_n=2, vars=['density', 'temperature', 'ye', 'c12', 'o16'],
+                            varx=['c12', 'o16'])
+    Dr = 3.0e6
+    tmpdir = tempfile.mkdtemp()
+    try:
+        text = os.path.join(tmpdir, 'grid.dat')
+        n = write_whole(text, remapper, Dr)
+        with open(text) as f:
+            header = f.readline() + f.readline()
+        rows = np.loadtxt(text, skiprows=2)
+        for format in ('raw', 'npy'):
+            whole = os.path.join(tmpdir, 'whole.' + format)
+            streamed = os.path.join(tmpdir, 'streamed.' + format)
+            write_whole(whole, remapper, Dr, format)
+            assert remapper.remapStream(Dr, streamed, chunk_size=7, format=format) == n
+            assert same_file(whole, streamed)
+            assert same_file(whole + '.header', streamed + '.header')
+            with open(whole + '.header') as f:
+                assert f.read() == header
+            if format == 'raw':
+                data = np.fromfile(whole, dtype='<f8').reshape(n, -1)
+            else:
+                data = np.load(whole)
+            assert data.shape == rows.shape
+            assert np.allclose(data, rows, rtol=1.0e-14, atol=0.0)
+    finally:
+        shutil.rmtree(tmpdir)
+
+def test_failed_write():
+    # A grid file that did not receive all its rows is removed, with its
+    # sidecar, and the error that stopped the remap is the one raised
+    import MesaRemap
+    star = synthetic_star()
+    remapper = MesaRemapper(star, poly_n=2, vars=['density', 'temperature', 'ye', 'c12', 'o16'],
+                            varx=['c12', 'o16'])
+    tmpdir = tempfile.mkdtemp()
+    remap_block = MesaRemap.remap_block
+    try:
+        name = os.path.join(tmpdir, 'grid.npy')
+        gridFile = GridFileWriter(name, remapper.vars, 10, 'npy')
+        gridFile.write(np.zeros(3), np.zeros((3, len(remapper.vars))))
+        try:
+            gridFile.finish()
+            assert False
+        except ValueError:
+            pass
+        assert not os.path.exists(name) and not os.path.exists(name + '.header')
+
+        calls = []
+        def failing_block(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 3:
+                raise np.linalg.LinAlgError('Singular matrix')
+            return remap_block(*args, **kwargs)
+        MesaRemap.remap_block = failing_block
+        for format in ('text', 'raw'):
+            del calls[:]
+            try:
+                remapper.remapStream(3.0e6, name, chunk_size=7, format=format)
+                assert False
+            except np.linalg.LinAlgError:
+                pass
+            assert not os.path.exists(name) and not os.path.exists(name + '.header')
+    finally:
+        MesaRemap.remap_block = remap_block
+        shutil.rmtree(tmpdir)
+
+if __name__ == '__main__':
+    for test in (test_find_overlaps, test_find_overlaps_random, test_mass_average, test_pool,
+                 test_stream, test_formats, test_failed_write):
+        test()
+        print(test.__name__ + ': OK')